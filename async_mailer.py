@@ -0,0 +1,183 @@
+import asyncio
+import time
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only needed for the asyncio client
+    aiohttp = None
+
+from onesignal_mailer import (
+    OneSignalMailer,
+    BatchResult,
+    MAX_BATCH_SIZE,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+    chunked,
+    json_bytes,
+    new_idempotency_key,
+    with_idempotency_key,
+)
+from retry import is_rate_limited
+
+# How many requests may be waiting on the API at once
+DEFAULT_MAX_IN_FLIGHT = 100
+
+
+class AsyncOneSignalMailer:
+    """asyncio sibling of OneSignalMailer.
+
+    Payloads are built by a regular OneSignalMailer, so configuration,
+    templates and payload fields are identical to the blocking client.
+    Requests share one aiohttp connection pool and at most `max_in_flight`
+    of them are outstanding at any time.
+    """
+
+    def __init__(self, mailer=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT, pool_size=None,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        if aiohttp is None:
+            raise ImportError("AsyncOneSignalMailer requires aiohttp. Install it with 'pip install aiohttp'.")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        self.mailer = mailer or OneSignalMailer()
+        self.max_in_flight = max_in_flight
+        self.pool_size = pool_size or max_in_flight
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+
+        # Created on first use so they bind to the running event loop
+        self.session = None
+        self.semaphore = None
+
+    def _ensure_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.mailer.headers,
+                timeout=self.timeout,
+            )
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self.session
+
+    async def close(self):
+        """Release pooled connections"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.mailer.close()
+
+    async def __aenter__(self):
+        self._ensure_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def set_email_template(self, template):
+        self.mailer.set_email_template(template)
+
+    def get_email_template(self):
+        return self.mailer.get_email_template()
+
+    async def post_payload(self, payload):
+        """POST a notification payload and return the decoded response"""
+        payload = with_idempotency_key(payload)
+        return await self.post_body(json_bytes(payload), len(payload['include_email_tokens']))
+
+    async def post_body(self, body, recipient_count):
+        """POST an encoded JSON body and return the decoded response.
+
+        Retries follow the wrapped mailer's `retry_policy`.
+        """
+        session = self._ensure_session()
+        rate_limiter = self.mailer.rate_limiter
+        retry_policy = self.mailer.retry_policy
+        metrics = self.mailer.metrics
+
+        attempt = 0
+        while True:
+            attempt += 1
+            if rate_limiter is not None:
+                await rate_limiter.acquire_async(rate_limiter.cost(recipient_count))
+
+            try:
+                async with self.semaphore:
+                    started = time.perf_counter()
+                    async with session.post(self.mailer.api_url, data=body) as response:
+                        # Raise an exception for bad responses
+                        response.raise_for_status()
+                        result = await response.json(content_type=None)
+            except Exception as e:
+                metrics.observe_error(time.perf_counter() - started, e, len(body))
+                if not retry_policy.should_retry(e, attempt):
+                    raise
+                metrics.observe_retry()
+                delay = retry_policy.delay(attempt, e)
+                if rate_limiter is not None and is_rate_limited(e):
+                    rate_limiter.throttle(pause=delay)
+                await asyncio.sleep(delay)
+                continue
+
+            metrics.observe_request(time.perf_counter() - started, response.status, len(body), recipient_count)
+            if rate_limiter is not None:
+                rate_limiter.recover()
+            return result
+
+    async def send_mail(self, message, subject, recipient_email):
+        payload = self.mailer.build_payload(message, subject, [recipient_email])
+        return await self.post_payload(payload)
+
+    async def _send_chunk(self, prepared, chunk):
+        started = time.perf_counter()
+        try:
+            # A fresh key per request, shared by its retries
+            response = await self.post_body(prepared.body(chunk, new_idempotency_key()), len(chunk))
+        except Exception as e:
+            batch_result = BatchResult(chunk, error=e)
+        else:
+            batch_result = BatchResult(chunk, response=response)
+        batch_result.latency = time.perf_counter() - started
+        return batch_result
+
+    async def send_batch(self, message, subject, recipients, batch_size=MAX_BATCH_SIZE):
+        """Send all chunks concurrently and return their results in order"""
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}")
+        prepared = self.mailer.prepare(message, subject)
+        return await asyncio.gather(*[
+            self._send_chunk(prepared, chunk)
+            for chunk in chunked(recipients, batch_size)
+        ])
+
+    async def iter_send(self, message, subject, recipients, batch_size=1):
+        """Send to recipients and yield a BatchResult as each request finishes.
+
+        Recipients are consumed lazily, so only about `max_in_flight` chunks
+        are held in memory no matter how long the input is::
+
+            async for result in mailer.iter_send(message, subject, recipients):
+                ...
+        """
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}")
+
+        self._ensure_session()
+        prepared = self.mailer.prepare(message, subject)
+        chunks = chunked(recipients, batch_size)
+        pending = set()
+        try:
+            while True:
+                # Keep the pipeline full without creating a task per recipient up front
+                for chunk in chunks:
+                    pending.add(asyncio.ensure_future(self._send_chunk(prepared, chunk)))
+                    if len(pending) >= self.max_in_flight:
+                        break
+                if not pending:
+                    return
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
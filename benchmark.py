@@ -0,0 +1,435 @@
+"""Throughput benchmark against a local OneSignal stand-in server.
+
+Usage:
+    python benchmark.py --recipients 20000 --latency 0.05
+    python benchmark.py --modes executor,async --workers 16 --save baseline.json
+    python benchmark.py --compare baseline.json
+    python benchmark.py --modes sequential --bandwidth 64000 --no-minify
+
+A fake /api/v1/notifications endpoint runs in this process with
+configurable latency, error rate and rate limiting, and checks the shape of
+every payload it receives. Each send mode then runs in a fresh process so
+its CPU time and peak memory are measured on their own. Nothing is sent to
+OneSignal.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+MODES = ('sequential', 'batch', 'executor', 'async')
+
+# The per-recipient loop is slow by design; it gets a smaller sample
+DEFAULT_SEQUENTIAL_RECIPIENTS = 200
+
+# Slowdown in recipients/second tolerated by --compare before it fails
+DEFAULT_TOLERANCE = 0.10
+
+API_PATH = '/api/v1/notifications'
+MAX_TOKENS = 2000
+
+BENCHMARK_SETTINGS = {
+    'ONESIGNAL_APP_ID': 'benchmark-app',
+    'ONESIGNAL_API_KEY': 'benchmark-key',
+    'EMAIL_FROM': 'benchmark@example.com',
+    'SENDER_NAME': 'Benchmark',
+}
+
+
+def check_payload(payload, headers):
+    """Problems with a notification request, as a list of messages"""
+    problems = []
+    if not headers.get('Authorization', '').startswith('Basic '):
+        problems.append("missing Basic Authorization header")
+    if not headers.get('Content-Type', '').startswith('application/json'):
+        problems.append("Content-Type is not application/json")
+    if not isinstance(payload, dict):
+        return problems + ["payload is not a JSON object"]
+
+    for field in ('app_id', 'email_subject', 'email_body', 'email_from_address'):
+        if not isinstance(payload.get(field), str) or not payload[field]:
+            problems.append(f"{field} must be a non-empty string")
+
+    tokens = payload.get('include_email_tokens')
+    if not isinstance(tokens, list) or not 1 <= len(tokens) <= MAX_TOKENS:
+        problems.append(f"include_email_tokens must be a list of 1 to {MAX_TOKENS} addresses")
+    elif not all(isinstance(token, str) and '@' in token for token in tokens):
+        problems.append("include_email_tokens contains something that isn't an address")
+
+    key = payload.get('idempotency_key')
+    if key is not None:
+        try:
+            uuid.UUID(key)
+        except (TypeError, ValueError, AttributeError):
+            problems.append("idempotency_key must be a UUID")
+    return problems
+
+
+class FakeOneSignalServer:
+    """Local stand-in for the notifications endpoint.
+
+    Each request waits `latency` seconds (plus up to `jitter`), fails with a
+    503 with probability `error_rate`, and gets a 429 with a Retry-After
+    header once more than `rate_limit` requests arrive in the same second.
+    With `bandwidth` (bytes per second) each request also takes as long as
+    its body would need on a link that slow, like a client on a poor uplink.
+    Malformed payloads get a 400 and are counted in `stats['invalid']`.
+    Repeated idempotency keys return the original response, as OneSignal
+    does, and are counted as duplicates.
+    """
+
+    def __init__(self, latency=0.02, jitter=0.0, error_rate=0.0, rate_limit=None, retry_after=1,
+                 bandwidth=None, host='127.0.0.1', port=0, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'recipients': 0, 'invalid': 0, 'errors': 0, 'rate_limited': 0,
+                      'duplicates': 0}
+        self.problems = []
+        self._responses = {}
+        self._window = None
+        self._window_count = 0
+
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PATH}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-onesignal', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _rate_limited(self):
+        if not self.rate_limit:
+            return False
+        window = int(time.monotonic())
+        with self.lock:
+            if window != self._window:
+                self._window, self._window_count = window, 0
+            self._window_count += 1
+            return self._window_count > self.rate_limit
+
+    def handle(self, path, headers, body):
+        """(status, extra headers, response object) for one request"""
+        with self.lock:
+            self.stats['requests'] += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            if self.bandwidth:
+                delay += len(body) / self.bandwidth
+            fail = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+
+        if path != API_PATH:
+            return 404, {}, {'errors': ["Not found"]}
+        if self._rate_limited():
+            with self.lock:
+                self.stats['rate_limited'] += 1
+            return 429, {'Retry-After': str(self.retry_after)}, {'errors': ["API rate limit exceeded"]}
+        if fail:
+            with self.lock:
+                self.stats['errors'] += 1
+            return 503, {}, {'errors': ["Service unavailable"]}
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+            problems = ["body is not valid JSON"]
+        else:
+            problems = check_payload(payload, headers)
+        if problems:
+            with self.lock:
+                self.stats['invalid'] += 1
+                if len(self.problems) < 20:
+                    self.problems.extend(problems)
+            return 400, {}, {'errors': problems}
+
+        key = payload.get('idempotency_key')
+        with self.lock:
+            if key is not None and key in self._responses:
+                self.stats['duplicates'] += 1
+                return 200, {}, self._responses[key]
+            response = {'id': str(uuid.uuid4()), 'recipients': len(payload['include_email_tokens'])}
+            if key is not None:
+                self._responses[key] = response
+            self.stats['recipients'] += len(payload['include_email_tokens'])
+        return 200, {}, response
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so the clients' connection pools are exercised
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are separate writes; don't let Nagle delay the body
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status, headers, response = fake.handle(self.path, self.headers, body)
+                data = json.dumps(response).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(int(q * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run_mode(mode, url, recipient_count, options):
+    """Send one campaign in `mode` and measure it; runs in a child process"""
+    os.environ.update(BENCHMARK_SETTINGS)
+
+    from campaign import CampaignExecutor
+    from metrics import SendMetrics
+    from onesignal_mailer import OneSignalMailer
+    from retry import RetryPolicy
+
+    class LatencyRecorder(SendMetrics):
+        """Keeps every latency so percentiles are exact, not bucketed"""
+
+        def __init__(self):
+            super().__init__()
+            self.latencies = []
+
+        def observe_request(self, latency, status, bytes_sent, recipients=0):
+            self.latencies.append(latency)
+            super().observe_request(latency, status, bytes_sent, recipients)
+
+    metrics = LatencyRecorder()
+    mailer = OneSignalMailer(pool_size=max(options['workers'], options['max_in_flight']), metrics=metrics,
+                             api_url=url, retry_policy=RetryPolicy(max_delay=options['max_retry_delay']),
+                             minify_body=options['minify'])
+    recipients = [f"user{i}@example.com" for i in range(recipient_count)]
+    message, subject = "Benchmark message", "Benchmark"
+    batch_size = options['batch_size']
+    failed = 0
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+
+    if mode == 'sequential':
+        # The original loop: one request per recipient, one at a time
+        for recipient in recipients:
+            try:
+                mailer.send_mail(message, subject, recipient)
+            except Exception:
+                failed += 1
+    elif mode == 'batch':
+        for batch_result in mailer.send_batch(message, subject, recipients, batch_size=batch_size):
+            failed += len(batch_result.failed)
+    elif mode == 'executor':
+        campaign = CampaignExecutor(mailer, workers=options['workers'], batch_size=batch_size).run(
+            message, subject, recipients)
+        failed = campaign.failure_count
+    elif mode == 'async':
+        from async_mailer import AsyncOneSignalMailer
+
+        async def send():
+            count = 0
+            async with AsyncOneSignalMailer(mailer, max_in_flight=options['max_in_flight']) as client:
+                async for batch_result in client.iter_send(message, subject, recipients, batch_size=batch_size):
+                    count += len(batch_result.failed)
+            return count
+
+        failed = asyncio.run(send())
+    else:
+        raise ValueError(f"Unknown mode {mode!r}")
+
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    mailer.close()
+
+    totals = metrics.snapshot().get('default', {})
+    latencies = sorted(metrics.latencies)
+    sent = recipient_count - failed
+    return {
+        'mode': mode,
+        'recipients': recipient_count,
+        'sent': sent,
+        'failed': failed,
+        'requests': len(latencies),
+        'bytes_per_request': totals.get('bytes_sent', 0) / len(latencies) if latencies else None,
+        'retries': totals.get('retries', 0),
+        'statuses': totals.get('statuses', {}),
+        'elapsed': elapsed,
+        'recipients_per_second': sent / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'cpu_seconds': cpu,
+        'cpu_percent': 100 * cpu / elapsed if elapsed else 0.0,
+        'max_rss_mb': max_rss_mb(),
+    }
+
+
+def format_table(results):
+    columns = [
+        ('mode', '{}', 10), ('recipients', '{:,}', 10), ('sent', '{:,}', 10), ('rcpt/s', '{:,.0f}', 10),
+        ('p50 ms', '{:.1f}', 8), ('p99 ms', '{:.1f}', 8), ('requests', '{:,}', 9), ('retries', '{:,}', 8),
+        ('bytes/req', '{:,.0f}', 10), ('cpu %', '{:.0f}', 6), ('rss MB', '{:.0f}', 7),
+    ]
+    keys = ['mode', 'recipients', 'sent', 'recipients_per_second', 'p50_ms', 'p99_ms', 'requests', 'retries',
+            'bytes_per_request', 'cpu_percent', 'max_rss_mb']
+    lines = ['  '.join(title.rjust(width) for title, _, width in columns)]
+    for result in results:
+        cells = []
+        for (title, fmt, width), key in zip(columns, keys):
+            value = result.get(key)
+            cells.append(('-' if value is None else fmt.format(value)).rjust(width))
+        lines.append('  '.join(cells))
+    return '\n'.join(lines)
+
+
+def compare(results, baseline, tolerance):
+    """Messages for modes whose throughput dropped more than `tolerance` below the baseline"""
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['mode'])
+        if not previous:
+            continue
+        floor = previous['recipients_per_second'] * (1 - tolerance)
+        if result['recipients_per_second'] < floor:
+            regressions.append(
+                f"{result['mode']}: {result['recipients_per_second']:,.0f} recipients/s, "
+                f"baseline {previous['recipients_per_second']:,.0f}"
+            )
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark send modes against a local fake OneSignal API.")
+    parser.add_argument('--modes', default=','.join(MODES), help=f"comma-separated modes (default: all of {', '.join(MODES)})")
+    parser.add_argument('--recipients', type=int, default=20000, help="recipients per mode (default: 20000)")
+    parser.add_argument('--sequential-recipients', type=int, default=DEFAULT_SEQUENTIAL_RECIPIENTS,
+                        help=f"recipients for the sequential mode (default: {DEFAULT_SEQUENTIAL_RECIPIENTS})")
+    parser.add_argument('--batch-size', type=int, default=MAX_TOKENS, help="recipients per request (default: 2000)")
+    parser.add_argument('--workers', type=int, default=8, help="executor worker threads (default: 8)")
+    parser.add_argument('--max-in-flight', type=int, default=8, help="async concurrent requests (default: 8)")
+    parser.add_argument('--latency', type=float, default=0.02, help="server latency in seconds (default: 0.02)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random server latency, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument('--bandwidth', type=float,
+                        help="simulated client uplink in bytes per second; request bodies take this long to arrive")
+    parser.add_argument('--no-minify', action='store_true', help="send the template without minifying it")
+    parser.add_argument('--rate-limit', type=int, help="requests per second before the server answers 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with a 429 (default: 1)")
+    parser.add_argument('--max-retry-delay', type=float, default=5.0, help="cap on client retry backoff (default: 5)")
+    parser.add_argument('--seed', type=int, help="seed for injected errors and jitter")
+    parser.add_argument('--save', help="write results to this JSON file, e.g. as a baseline")
+    parser.add_argument('--compare', help="baseline JSON file; exit 1 if any mode got slower")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f"allowed slowdown against the baseline (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument('--json', action='store_true', help="print results as JSON instead of a table")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        print(f"Error: unknown mode(s) {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    options = {
+        'batch_size': args.batch_size,
+        'workers': args.workers,
+        'max_in_flight': args.max_in_flight,
+        'max_retry_delay': args.max_retry_delay,
+        'minify': not args.no_minify,
+    }
+    server = FakeOneSignalServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                 rate_limit=args.rate_limit, retry_after=args.retry_after,
+                                 bandwidth=args.bandwidth, seed=args.seed)
+    results = []
+    with server:
+        for mode in modes:
+            count = args.sequential_recipients if mode == 'sequential' else args.recipients
+            # A fresh process per mode keeps CPU and memory figures separate
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                results.append(pool.submit(run_mode, mode, server.url, count, options).result())
+
+    if args.json:
+        print(json.dumps({'results': results, 'server': server.stats}, indent=2))
+    else:
+        print(format_table(results))
+        print(f"server: {json.dumps(server.stats)}")
+
+    status = 0
+    if server.stats['invalid']:
+        print(f"Invalid payloads: {'; '.join(sorted(set(server.problems)))}", file=sys.stderr)
+        status = 1
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({result['mode']: result for result in results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
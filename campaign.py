@@ -0,0 +1,300 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from metrics import DEFAULT_CAMPAIGN, campaign_label
+from onesignal_mailer import MAX_BATCH_SIZE, chunked
+from personalize import PersonalizedCampaign, FailedRender
+from rate_limiter import PER_RECIPIENT
+from recipients import recipient_email
+
+DEFAULT_WORKERS = 4
+
+# How often the coordinator wakes up to check for a stop request (seconds)
+POLL_INTERVAL = 0.2
+
+
+class CampaignResult:
+    """Aggregated outcome of a campaign run"""
+
+    def __init__(self):
+        self.total = 0
+        self.success_count = 0
+        self.failed = {}
+        self.stopped = False
+        self.validation = None
+        self.suppressed = 0
+        # Recipients skipped because a resumed journal shows them as sent
+        self.already_sent = 0
+
+    @property
+    def failure_count(self):
+        return len(self.failed)
+
+    def add(self, batch_result):
+        self.total += len(batch_result.recipients)
+        self.success_count += len(batch_result.sent)
+        self.failed.update(batch_result.failed)
+
+
+class CampaignExecutor:
+    """Send a campaign from a pool of worker threads sharing one mailer.
+
+    `on_result` is called with each BatchResult and the running
+    CampaignResult as requests complete. It always runs on the thread that
+    called `run()`, never on a worker, so callers don't need extra locking.
+    Calling `stop()` (or setting `stop_event`) stops new requests from being
+    started within POLL_INTERVAL; requests already in flight are drained.
+
+    `validator` is an optional RecipientValidator run over the recipient
+    stream before anything is sent; its report ends up on the result.
+
+    `suppression` is an optional SuppressionList: suppressed recipients are
+    skipped before sending, and addresses OneSignal reports as invalid are
+    added to it so they are not mailed again.
+
+    `journal` is an optional CampaignJournal. Every batch is journaled as
+    attempted (durably) before it is sent and as sent or failed afterwards.
+    When the journal was resumed, recipients it shows as sent are skipped
+    and batches with no recorded outcome are re-sent with their original
+    idempotency key, so OneSignal drops them if they already went out.
+    Without a journal each batch still gets a random idempotency key, so the
+    mailer's own retries can't deliver twice.
+
+    `rate_limiter` is a TokenBucket applied across all workers and defaults
+    to the mailer's own bucket. Tokens are taken here, before a request is
+    handed to a worker, so waiting on the limiter never delays a stop.
+    Batches are split to at most the bucket's burst, so a low rate sends
+    small requests steadily instead of a full batch followed by a long stall.
+
+    Requests are counted in the mailer's metrics under `name`, which
+    defaults to the journal's campaign id.
+
+    `results` is an optional ResultsStore; every batch outcome is queued to
+    it under the campaign's `name`.
+
+    `planner` is an optional SlotPlanner for server-side scheduling: every
+    batch is split to fit its delivery slots and sent with OneSignal's
+    `send_after`, so the campaign is submitted as fast as the workers allow
+    and OneSignal spaces out delivery. Leave the rate limiter off in this
+    mode.
+
+    `dead_letters` is an optional DeadLetterQueue that keeps every failed
+    recipient with a reference to its payload, so retryable failures can be
+    replayed later.
+
+    `domain_scheduler` is an optional DomainScheduler that interleaves
+    recipients by domain, and applies per-domain caps, before they are
+    batched.
+    """
+
+    def __init__(self, mailer, workers=DEFAULT_WORKERS, batch_size=MAX_BATCH_SIZE,
+                 rate_limiter=None, validator=None, suppression=None, journal=None, on_result=None,
+                 stop_event=None, name=None, planner=None, results=None, domain_scheduler=None,
+                 dead_letters=None):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}")
+
+        self.mailer = mailer
+        self.workers = workers
+        self.batch_size = batch_size
+        self.rate_limiter = rate_limiter if rate_limiter is not None else getattr(mailer, 'rate_limiter', None)
+        self.validator = validator
+        self.suppression = suppression
+        self.journal = journal
+        self.on_result = on_result
+        self.stop_event = stop_event or threading.Event()
+        if name is None:
+            name = journal.campaign_id if journal is not None else DEFAULT_CAMPAIGN
+        self.name = name
+        self.planner = planner
+        self.results = results
+        self.domain_scheduler = domain_scheduler
+        self.dead_letters = dead_letters
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def _acquire(self, recipient_count):
+        """Wait for rate limiter tokens; False if stopped while waiting"""
+        limiter = self.rate_limiter
+        if limiter is None:
+            return True
+        return limiter.acquire(limiter.cost(recipient_count), stop_event=self.stop_event)
+
+    @property
+    def _prepaid(self):
+        # The mailer would otherwise charge its bucket a second time; a
+        # manager's ShareClient draws on the mailer's bucket too
+        limiter = self.rate_limiter
+        if limiter is None:
+            return False
+        return getattr(limiter, 'bucket', limiter) is getattr(self.mailer, 'rate_limiter', None)
+
+    def _collect_result(self, batch_result, result):
+        result.add(batch_result)
+        if self.results is not None:
+            self.results.record(self.name, batch_result)
+        if self.suppression is not None and batch_result.invalid:
+            # Bounced as undeliverable; never try these again
+            self.suppression.add_many(batch_result.invalid)
+        if self.on_result is not None:
+            self.on_result(batch_result, result)
+
+    def _collect(self, done, result):
+        for future in done:
+            self._collect_result(future.result(), result)
+
+    def work_items(self, message, subject, recipients, held=None):
+        """Yield (prepared send, addresses, idempotency key) triples, one per request.
+
+        `held` maps the keys of in-doubt batches from a resumed journal to
+        their recipients; those batches are yielded last, once `recipients`
+        has been consumed, with their original key.
+        """
+        # Later template edits must not change this campaign's remaining emails
+        template = self.mailer.compiled_template
+        sender_name = self.mailer.sender_name
+        if self.mailer.is_personalized(template):
+            # Group recipients whose rendered email is identical
+            campaign = PersonalizedCampaign(self.mailer, message, subject, batch_size=self.batch_size,
+                                            template=template, sender_name=sender_name)
+            for prepared, chunk in campaign.work_items(recipients):
+                yield prepared, chunk, None
+            prepared_for = campaign.prepared_for
+        else:
+            # Render and serialize the campaign once; workers only splice recipients
+            prepared = self.mailer.prepare(message, subject, template=template, sender_name=sender_name)
+            for chunk in chunked(map(recipient_email, recipients), self.batch_size):
+                yield prepared, chunk, None
+
+            def prepared_for(recipient):
+                return prepared
+
+        for key, batch in (held or {}).items():
+            # A batch shares one rendering, so its first row stands for all of them
+            yield prepared_for(batch[0]), [recipient_email(recipient) for recipient in batch], key
+
+    def _request_size(self):
+        """Most recipients one request may carry without putting the rate limiter in debt"""
+        limiter = self.rate_limiter
+        bucket = getattr(limiter, 'bucket', limiter)
+        burst = getattr(bucket, 'burst', None)
+        if burst is None or not getattr(limiter, 'metered', True) or getattr(bucket, 'per', None) != PER_RECIPIENT:
+            return self.batch_size
+        return max(1, min(self.batch_size, int(burst)))
+
+    def requests(self, message, subject, recipients, held=None):
+        """Yield (prepared send, addresses, idempotency key, send_after), one per request"""
+        for prepared, chunk, key in self.work_items(message, subject, recipients, held):
+            if isinstance(prepared, FailedRender):
+                yield prepared, chunk, key, None
+                continue
+            if self.planner is None:
+                # Read per batch, as the rate can be changed mid-campaign; a
+                # journaled batch keeps its key, so it is sent whole
+                size = self._request_size()
+                for piece in (chunked(chunk, size) if key is None and len(chunk) > size else [chunk]):
+                    yield prepared, piece, key, None
+                continue
+            # A journaled batch keeps its key, so it can't be split across slots
+            for send_after, piece in self.planner.plan(chunk, split=key is None):
+                yield prepared, piece, key, send_after
+
+    def _skip_journaled(self, recipients, result, held):
+        """Drop recipients the journal shows as sent; hold back in-doubt ones"""
+        state = self.journal.state
+        in_doubt = state.in_doubt_batches()
+        for recipient in recipients:
+            email = recipient_email(recipient)
+            if state.is_sent(email):
+                result.already_sent += 1
+                continue
+            key = in_doubt.get(email)
+            if key is not None:
+                held.setdefault(key, []).append(recipient)
+                continue
+            yield recipient
+
+    def _dead_letter(self, prepared, batch_result):
+        if self.dead_letters is not None and batch_result.failed:
+            self.dead_letters.record(self.name, prepared, batch_result)
+        return batch_result
+
+    def _send(self, prepared, chunk, key, send_after=None):
+        with campaign_label(self.name):
+            return self._dead_letter(prepared, self._send_batch(prepared, chunk, key, send_after))
+
+    def _send_batch(self, prepared, chunk, key, send_after=None):
+        """Worker body: journal the attempt, send, journal the outcome"""
+        if self.journal is None:
+            # Without a key send_chunk makes a fresh one
+            return prepared.send_chunk(chunk, self._prepaid, idempotency_key=key, send_after=send_after)
+
+        key = key or self.journal.batch_key(chunk)
+        # The attempt must be on disk before the request can reach OneSignal
+        self.journal.wait_durable(self.journal.record_attempt(key, chunk))
+        batch_result = prepared.send_chunk(chunk, self._prepaid, idempotency_key=key, send_after=send_after)
+        self.journal.record_result(key, batch_result)
+        return batch_result
+
+    def run(self, message, subject, recipients):
+        """Send to every recipient and return a CampaignResult.
+
+        Recipients are addresses or data rows (dicts with an 'email' key
+        and merge field values) and are consumed lazily.
+        """
+        result = CampaignResult()
+        in_flight = set()
+        if self.results is not None:
+            self.results.start_campaign(self.name, subject)
+
+        if self.validator is not None:
+            # Invalid and duplicate addresses are dropped before any network I/O
+            recipients = self.validator.filter(recipients)
+            result.validation = self.validator.report
+
+        if self.suppression is not None:
+            def count_suppressed(address):
+                result.suppressed += 1
+
+            recipients = self.suppression.filter(recipients, on_suppressed=count_suppressed,
+                                                 normalized=self.validator is not None)
+
+        held = {}
+        if self.journal is not None:
+            recipients = self._skip_journaled(recipients, result, held)
+
+        if self.domain_scheduler is not None:
+            # Spread each mailbox provider's recipients across the whole campaign
+            recipients = self.domain_scheduler.schedule(recipients, stop_event=self.stop_event)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='campaign') as pool:
+            for prepared, chunk, key, send_after in self.requests(message, subject, recipients, held):
+                if isinstance(prepared, FailedRender):
+                    # Nothing to send; report the rendering error straight away
+                    self._collect_result(self._dead_letter(prepared, prepared.send_chunk(chunk)), result)
+                    continue
+
+                # Never queue more requests than there are workers so memory stays bounded
+                while len(in_flight) >= self.workers and not self.stopped:
+                    done, in_flight = wait(in_flight, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                    self._collect(done, result)
+                if self.stopped or not self._acquire(len(chunk)):
+                    break
+
+                in_flight.add(pool.submit(self._send, prepared, chunk, key, send_after))
+
+            # Drain whatever is still in flight
+            done, _ = wait(in_flight)
+            self._collect(done, result)
+
+        result.stopped = self.stopped
+        if self.results is not None and not result.stopped:
+            self.results.finish_campaign(self.name)
+        return result
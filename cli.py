@@ -0,0 +1,370 @@
+"""Headless campaign runner.
+
+Usage:
+    python cli.py recipients.csv --subject "Spring sale" --message-file body.txt --rate 50
+
+Progress is printed to stdout as one JSON object per line. Only the standard
+library is imported until the arguments have been parsed, and Tk is never
+imported, so the runner starts quickly and works without a display.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+# Settings file written by the GUI
+SETTINGS_FILE = 'settings.json'
+SETTINGS_ENV = {
+    'app_id': 'ONESIGNAL_APP_ID',
+    'api_key': 'ONESIGNAL_API_KEY',
+    'email_from': 'EMAIL_FROM',
+    'sender_name': 'SENDER_NAME',
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Send a OneSignal email campaign without the GUI.")
+    parser.add_argument('recipients', help="CSV file with an email column, or one address per line")
+    parser.add_argument('--subject', required=True, help="email subject")
+    message = parser.add_mutually_exclusive_group(required=True)
+    message.add_argument('--message', help="message text")
+    message.add_argument('--message-file', help="file containing the message text")
+    parser.add_argument('--template', help="HTML template file (default: built-in template)")
+    parser.add_argument('--no-minify', action='store_true', help="send the template's HTML exactly as written")
+    parser.add_argument('--rate', type=float, default=0,
+                        help="maximum recipients per second, 0 for unlimited (default: 0)")
+    parser.add_argument('--burst', type=float, help="rate limiter burst size (default: one second's worth)")
+    parser.add_argument('--schedule', action='store_true',
+                        help="submit everything now and let OneSignal deliver at --rate using send_after")
+    parser.add_argument('--start-at', help="with --schedule, first delivery time (ISO 8601 with a UTC offset)")
+    parser.add_argument('--interleave-domains', action='store_true',
+                        help="mix recipient domains round-robin instead of sending in file order")
+    parser.add_argument('--domain-rate', action='append', default=[], metavar='DOMAIN=RATE',
+                        help="cap one domain at RATE recipients per second, e.g. gmail.com=50 (repeatable; "
+                             "implies --interleave-domains)")
+    parser.add_argument('--default-domain-rate', type=float,
+                        help="cap every other domain at this many recipients per second")
+    parser.add_argument('--domain-buffer', type=int, default=10000,
+                        help="recipients held back for interleaving domains (default: 10000)")
+    parser.add_argument('--workers', type=int, default=4, help="concurrent requests (default: 4)")
+    parser.add_argument('--batch-size', type=int, default=2000, help="recipients per request (default: 2000)")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="send from this many processes, each with its own shard of recipients (default: 1)")
+    parser.add_argument('--shard-count', type=int,
+                        help="number of shards recipients are split into (default: --processes)")
+    parser.add_argument('--shards', help="comma-separated shard indices to run, e.g. to rerun a failed shard")
+    parser.add_argument('--journal', help="campaign journal file, for resuming after a crash")
+    parser.add_argument('--resume', action='store_true', help="skip recipients the journal shows as sent")
+    parser.add_argument('--results-db', help="SQLite file to record every recipient's outcome in")
+    parser.add_argument('--dead-letters',
+                        help="SQLite file to keep failed recipients in for replaying (see deadletter.py)")
+    parser.add_argument('--suppression', help="suppression list index to screen recipients against")
+    parser.add_argument('--no-validate', action='store_true', help="skip address validation and de-duplication")
+    parser.add_argument('--env-file', default='.env', help="file with OneSignal settings (default: .env)")
+    parser.add_argument('--settings', default=SETTINGS_FILE,
+                        help=f"GUI settings file used when variables are unset (default: {SETTINGS_FILE})")
+    parser.add_argument('--metrics-file',
+                        help="write send metrics here with each progress line (JSON if it ends in .json, "
+                             "Prometheus text otherwise)")
+    parser.add_argument('--progress-interval', type=float, default=1.0,
+                        help="seconds between progress lines (default: 1)")
+    return parser
+
+
+def emit(event, **fields):
+    """Print one machine-readable progress line"""
+    fields = dict(event=event, ts=round(time.time(), 3), **fields)
+    sys.stdout.write(json.dumps(fields) + '\n')
+    sys.stdout.flush()
+
+
+def read_text(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def parse_start(value):
+    """Timezone-aware datetime for --start-at, or None"""
+    if not value:
+        return None
+    from datetime import datetime
+    start = datetime.fromisoformat(value)
+    if start.tzinfo is None:
+        raise ValueError("--start-at needs a UTC offset, e.g. 2024-05-01T09:00:00+00:00")
+    return start
+
+
+def parse_domain_rates(values):
+    """{domain: rate} from --domain-rate DOMAIN=RATE values"""
+    rates = {}
+    for value in values:
+        domain, sep, rate = value.partition('=')
+        if not sep or not domain.strip():
+            raise ValueError(f"--domain-rate expects DOMAIN=RATE, got {value!r}")
+        rates[domain.strip()] = float(rate)
+    return rates
+
+
+def domain_scheduler(args):
+    """DomainScheduler for the domain options, or None if they are unused"""
+    domain_rates = parse_domain_rates(args.domain_rate)
+    if not (args.interleave_domains or domain_rates or args.default_domain_rate):
+        return None
+    from domains import DomainScheduler
+    return DomainScheduler(args.domain_buffer, domain_rates=domain_rates, default_rate=args.default_domain_rate)
+
+
+def campaign_name(args):
+    """Campaign id for metrics and results when there is no journal"""
+    return f"{os.path.basename(args.recipients)}-{time.strftime('%Y%m%d-%H%M%S')}"
+
+
+def load_settings(args):
+    """Fill OneSignal settings from the .env file, then the GUI settings file"""
+    if args.env_file and os.path.exists(args.env_file):
+        from onesignal_mailer import load_env_file
+        load_env_file(args.env_file)
+
+    if all(os.getenv(name) for name in SETTINGS_ENV.values()):
+        return
+    if args.settings and os.path.exists(args.settings):
+        with open(args.settings) as f:
+            settings = json.load(f)
+        for key, name in SETTINGS_ENV.items():
+            if not os.getenv(name) and settings.get(key):
+                os.environ[name] = settings[key]
+
+
+def run(args):
+    # Heavy modules are imported only once we know there is work to do
+    from campaign import CampaignExecutor
+    from onesignal_mailer import OneSignalMailer
+    from rate_limiter import TokenBucket
+    from recipients import RecipientFile
+
+    load_settings(args)
+    message = args.message if args.message is not None else read_text(args.message_file)
+    recipients = RecipientFile(args.recipients)
+
+    mailer = OneSignalMailer(pool_size=max(args.workers, 1), minify_body=not args.no_minify)
+    if args.template:
+        mailer.set_email_template(read_text(args.template))
+    planner = None
+    if args.schedule and args.rate:
+        from scheduling import SlotPlanner
+        planner = SlotPlanner(args.rate * 3600, start=parse_start(args.start_at))
+    elif args.rate:
+        mailer.rate_limiter = TokenBucket(args.rate, burst=args.burst)
+
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, request_stop)
+
+    started = time.monotonic()
+    last_report = [started]
+
+    def progress(progress_result):
+        elapsed = time.monotonic() - started
+        return {
+            'attempted': progress_result.total,
+            'sent': progress_result.success_count,
+            'failed': progress_result.failure_count,
+            'elapsed': round(elapsed, 3),
+            'recipients_per_second': round(progress_result.success_count / elapsed, 1) if elapsed else 0.0,
+        }
+
+    def on_result(batch_result, progress_result):
+        for recipient, error in batch_result.failed.items():
+            emit('failed', recipient=recipient, error=error)
+        now = time.monotonic()
+        if now - last_report[0] >= args.progress_interval:
+            last_report[0] = now
+            emit('progress', **progress(progress_result))
+            if args.metrics_file:
+                mailer.metrics.write(args.metrics_file)
+
+    emit('start', recipients=args.recipients, estimated_total=recipients.estimated_count(),
+         workers=args.workers, batch_size=args.batch_size, rate=args.rate or None,
+         body_bytes_saved=mailer.body_bytes_saved)
+
+    if args.processes > 1 or args.shards:
+        return run_sharded(args, mailer, message, recipients, stop_event, progress)
+
+    validator = None
+    if not args.no_validate:
+        from validation import RecipientValidator
+        validator = RecipientValidator()
+
+    suppression = None
+    if args.suppression:
+        from suppression import SuppressionList
+        suppression = SuppressionList(args.suppression)
+
+    journal = None
+    if args.journal:
+        from journal import CampaignJournal, content_id
+        content = content_id(args.subject, message, mailer.get_email_template(),
+                             os.path.abspath(args.recipients))
+        journal = CampaignJournal(args.journal, content=content, resume=args.resume)
+
+    results = None
+    if args.results_db:
+        from results import ResultsStore
+        results = ResultsStore(args.results_db)
+
+    dead_letters = None
+    if args.dead_letters:
+        from deadletter import DeadLetterQueue
+        dead_letters = DeadLetterQueue(args.dead_letters)
+
+    scheduler = domain_scheduler(args)
+    campaign = None
+    try:
+        executor = CampaignExecutor(
+            mailer,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            validator=validator,
+            suppression=suppression,
+            journal=journal,
+            on_result=on_result,
+            stop_event=stop_event,
+            planner=planner,
+            results=results,
+            name=journal.campaign_id if journal is not None else campaign_name(args),
+            domain_scheduler=scheduler,
+            dead_letters=dead_letters,
+        )
+        campaign = executor.run(message, args.subject, recipients)
+    finally:
+        if results is not None:
+            results.close()
+        if dead_letters is not None:
+            dead_letters.close()
+        if journal is not None:
+            journal.close(done=campaign is not None and not campaign.stopped)
+        if suppression is not None:
+            suppression.close()
+        mailer.close()
+
+    summary = progress(campaign)
+    summary['campaign'] = executor.name
+    summary['stopped'] = campaign.stopped
+    summary['already_sent'] = campaign.already_sent
+    summary['suppressed'] = campaign.suppressed
+    if campaign.validation is not None:
+        summary['rejected'] = campaign.validation.rejected
+    if scheduler is not None:
+        summary['domain_wait'] = round(scheduler.waited, 3)
+    if planner is not None and planner.planned:
+        summary['delivery_start'] = planner.start.isoformat()
+        summary['delivery_end'] = planner.end.isoformat()
+    emit('done', **summary)
+    if args.metrics_file:
+        mailer.metrics.write(args.metrics_file)
+
+    if campaign.stopped:
+        return EXIT_INTERRUPTED
+    return EXIT_FAILURES if campaign.failed else EXIT_OK
+
+
+def run_sharded(args, mailer, message, recipients, stop_event, progress):
+    from journal import content_id
+    from sharding import ShardedCampaign
+
+    content = content_id(args.subject, message, mailer.get_email_template(), os.path.abspath(args.recipients))
+    last_report = [0.0]
+
+    def on_progress(attempted, sent, failed):
+        now = time.monotonic()
+        if now - last_report[0] >= args.progress_interval:
+            last_report[0] = now
+            emit('progress', attempted=attempted, sent=sent, failed=failed)
+
+    sharded = ShardedCampaign(
+        mailer,
+        shard_count=args.shard_count,
+        processes=args.processes,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        rate=args.rate,
+        burst=args.burst,
+        validate=not args.no_validate,
+        suppression_path=args.suppression,
+        journal_path=args.journal,
+        resume=args.resume,
+        content=content,
+        schedule=args.schedule,
+        schedule_start=parse_start(args.start_at),
+        results_path=args.results_db,
+        dead_letters_path=args.dead_letters,
+        interleave_domains=args.interleave_domains,
+        domain_buffer=args.domain_buffer,
+        domain_rates=parse_domain_rates(args.domain_rate),
+        default_domain_rate=args.default_domain_rate,
+        name=content,
+        on_progress=on_progress,
+    )
+    # Forward Ctrl+C and SIGTERM to the worker processes
+    threading.Thread(target=lambda: stop_event.wait() or sharded.stop(), daemon=True).start()
+
+    shards = [int(index) for index in args.shards.split(',')] if args.shards else None
+    try:
+        campaign = sharded.run(message, args.subject, recipients, shards=shards)
+    finally:
+        mailer.close()
+
+    for recipient, error in campaign.failed.items():
+        emit('failed', recipient=recipient, error=error)
+    for index, error in sorted(campaign.failed_shards.items()):
+        emit('shard_failed', shard=index, shard_count=sharded.shard_count, error=error)
+
+    summary = progress(campaign)
+    summary['campaign'] = content
+    summary['stopped'] = campaign.stopped
+    summary['already_sent'] = campaign.already_sent
+    summary['suppressed'] = campaign.suppressed
+    summary['completed_shards'] = sorted(campaign.completed_shards)
+    if campaign.validation is not None:
+        summary['rejected'] = campaign.validation.rejected
+    emit('done', **summary)
+    if args.metrics_file:
+        from metrics import write_snapshot
+        write_snapshot(campaign.metrics, args.metrics_file)
+
+    if campaign.stopped:
+        return EXIT_INTERRUPTED
+    return EXIT_FAILURES if campaign.failed or campaign.failed_shards else EXIT_OK
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.processes < 1 or args.workers < 1 or not 1 <= args.batch_size <= 2000 or args.rate < 0:
+        parser.error("--processes and --workers must be at least 1, --batch-size between 1 and 2000, "
+                     "and --rate non-negative")
+
+    try:
+        return run(args)
+    except (OSError, ValueError) as e:
+        emit('error', error=str(e))
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return EXIT_USAGE
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,490 @@
+"""Persistent queue of failed recipients, with bulk replay.
+
+From the command line:
+    python deadletter.py summary
+    python deadletter.py list --campaign <campaign id>
+    python deadletter.py replay --rate 50
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import weakref
+import zlib
+
+import requests
+
+from campaign import CampaignExecutor, DEFAULT_WORKERS
+from onesignal_mailer import MAX_BATCH_SIZE, PreparedSend, chunked
+from retry import RETRYABLE_STATUS, error_status, transient_errors
+
+DEFAULT_DEAD_LETTER_PATH = 'dead_letters.db'
+
+# Dead letter statuses
+PENDING = 'pending'
+REPLAYED = 'replayed'
+
+# Error classes that aren't HTTP statuses or exception names
+INVALID = 'invalid'
+REJECTED = 'rejected'
+TIMEOUT = 'timeout'
+CONNECTION = 'connection'
+
+# Most rows written in one transaction
+WRITE_BATCH_ROWS = 10000
+
+# Pending rows read per query while replaying
+READ_PAGE_ROWS = 10000
+
+# Seconds a replay holds its claim on rows; renewed while it runs, so rows
+# only go back to the queue when a replay dies without releasing them
+REPLAY_LEASE = 600
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS payloads (
+    id TEXT PRIMARY KEY,
+    campaign TEXT,
+    body BLOB NOT NULL,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    campaign TEXT,
+    recipient TEXT NOT NULL,
+    error_class TEXT NOT NULL,
+    retryable INTEGER NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    status TEXT NOT NULL DEFAULT 'pending',
+    ts REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_until REAL,
+    UNIQUE (payload, recipient)
+);
+CREATE INDEX IF NOT EXISTS dead_letters_replay ON dead_letters (status, retryable, payload);
+CREATE INDEX IF NOT EXISTS dead_letters_campaign ON dead_letters (campaign, status);
+'''
+
+# A recipient that fails again under the same payload updates its existing row
+UPSERT_DEAD_LETTER = '''
+INSERT INTO dead_letters (payload, campaign, recipient, error_class, retryable, error, ts)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (payload, recipient) DO UPDATE SET
+    attempts = attempts + 1, error_class = excluded.error_class, retryable = excluded.retryable,
+    error = excluded.error, status = 'pending', ts = excluded.ts, claimed_by = NULL, claimed_until = NULL
+'''
+
+# Columns added after the first release, for databases created before them
+MIGRATIONS = {
+    'claimed_by': 'ALTER TABLE dead_letters ADD COLUMN claimed_by TEXT',
+    'claimed_until': 'ALTER TABLE dead_letters ADD COLUMN claimed_until REAL',
+}
+
+LIST_COLUMNS = ('campaign', 'recipient', 'error_class', 'retryable', 'error', 'attempts', 'status', 'ts')
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+def classify(batch_result, recipient, invalid=()):
+    """(error class, retryable) for one failed recipient of a BatchResult"""
+    if recipient in invalid:
+        return INVALID, False
+    error = batch_result.error
+    if error is None:
+        # The API answered but refused the recipients, e.g. unsubscribed
+        return REJECTED, False
+    status = error_status(error)
+    if status is not None:
+        return f"http_{status}", status in RETRYABLE_STATUS
+    if isinstance(error, transient_errors()):
+        return (TIMEOUT if isinstance(error, (requests.Timeout, TimeoutError)) else CONNECTION), True
+    # Rendering and other local errors fail the same way every time
+    return type(error).__name__, False
+
+
+def dead_letter_rows(campaign, payload, batch_result, ts=None):
+    """dead_letters rows for the failed recipients of one BatchResult"""
+    ts = time.time() if ts is None else ts
+    invalid = set(batch_result.invalid)
+    rows = []
+    for recipient, error in batch_result.failed.items():
+        error_class, retryable = classify(batch_result, recipient, invalid)
+        rows.append((payload, campaign, recipient, error_class, int(retryable), error, ts))
+    return rows
+
+
+class DeadLetterQueue:
+    """SQLite queue of recipients that could not be sent, for replaying later.
+
+    Each failure is stored with its error class, whether it is worth
+    retrying, and the payload it was sent with. Payloads (the request body
+    without its recipients) are stored once, compressed, so a replay sends
+    exactly the same email without needing the template or merge data.
+    Like ResultsStore, `record()` only queues; a writer thread does the
+    inserts in batched transactions.
+    """
+
+    def __init__(self, path=DEFAULT_DEAD_LETTER_PATH):
+        self.path = path
+        with contextlib.closing(_connect(path)) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            columns = {row['name'] for row in connection.execute('PRAGMA table_info(dead_letters)')}
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    connection.execute(statement)
+            connection.commit()
+
+        # Payload ids already queued for storing by this process
+        self._payloads = set()
+        self._queue = queue.SimpleQueue()
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, name='dead-letter-writer', daemon=True)
+        self._writer.start()
+
+    def record(self, campaign, prepared, batch_result):
+        """Queue the failed recipients of a batch; returns immediately"""
+        if not batch_result.failed:
+            return
+        # A FailedRender has no payload; its recipients are never retryable
+        payload = getattr(prepared, 'payload_id', '')
+        if payload and payload not in self._payloads:
+            self._payloads.add(payload)
+            self._queue.put(('payload', (payload, campaign, prepared.suffix, time.time())))
+        self._queue.put(('failed', (campaign, payload, batch_result, time.time())))
+
+    def resolve(self, payload, recipients):
+        """Queue marking recipients of a payload as delivered by a replay"""
+        self._queue.put(('resolved', [(time.time(), payload, recipient) for recipient in recipients]))
+
+    def flush(self):
+        """Block until everything queued so far is written"""
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        done.wait()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self._queue.put(('close', None))
+        self._writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_loop(self):
+        connection = _connect(self.path)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        closing = False
+        while not closing:
+            items = [self._queue.get()]
+            rows = 0
+            while rows < WRITE_BATCH_ROWS:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                items.append(item)
+                if item[0] == 'failed':
+                    rows += len(item[1][2].failed)
+                elif item[0] == 'resolved':
+                    rows += len(item[1])
+
+            flushes = []
+            try:
+                with connection:
+                    for kind, value in items:
+                        if kind == 'payload':
+                            payload, campaign, suffix, ts = value
+                            connection.execute(
+                                'INSERT OR IGNORE INTO payloads (id, campaign, body, created) VALUES (?, ?, ?, ?)',
+                                (payload, campaign, zlib.compress(suffix), ts))
+                        elif kind == 'failed':
+                            # In order, so a failure after a replay's success reopens the row
+                            connection.executemany(UPSERT_DEAD_LETTER, dead_letter_rows(*value))
+                        elif kind == 'resolved':
+                            connection.executemany(
+                                f"UPDATE dead_letters SET status = '{REPLAYED}', ts = ?, claimed_by = NULL, "
+                                "claimed_until = NULL WHERE payload = ? AND recipient = ?", value)
+                        elif kind == 'flush':
+                            flushes.append(value)
+                        elif kind == 'close':
+                            closing = True
+            except sqlite3.Error as e:
+                self._error = e
+            for done in flushes:
+                done.set()
+        connection.close()
+
+    def _replayable(self, campaign=None, max_attempts=None):
+        # Rows claimed by a running replay are left to it
+        conditions = ["status = ?", "retryable = 1", "(claimed_until IS NULL OR claimed_until < ?)"]
+        params = [PENDING, time.time()]
+        if campaign is not None:
+            conditions.append('campaign = ?')
+            params.append(campaign)
+        if max_attempts is not None:
+            conditions.append('attempts < ?')
+            params.append(max_attempts)
+        return ' AND '.join(conditions), params
+
+    def count_replayable(self, campaign=None, max_attempts=None):
+        self.flush()
+        where, params = self._replayable(campaign, max_attempts)
+        with contextlib.closing(_connect(self.path)) as connection:
+            return connection.execute(f"SELECT COUNT(*) FROM dead_letters WHERE {where}", params).fetchone()[0]
+
+    def replayable(self, campaign=None, max_attempts=None):
+        """ReplayClaim yielding {'email', 'payload'} rows of retryable failures, grouped by payload"""
+        self.flush()
+        return ReplayClaim(self, campaign, max_attempts)
+
+    def payload(self, payload_id):
+        """Stored request body suffix for a payload id"""
+        with contextlib.closing(_connect(self.path)) as connection:
+            row = connection.execute('SELECT body FROM payloads WHERE id = ?', (payload_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown payload {payload_id}")
+        return zlib.decompress(row['body'])
+
+    def summary(self, campaign=None):
+        """Pending and replayed counts by error class"""
+        self.flush()
+        sql = ('SELECT status, error_class, retryable, COUNT(*) AS count FROM dead_letters'
+               + (' WHERE campaign = ?' if campaign is not None else '')
+               + ' GROUP BY status, error_class, retryable ORDER BY status, count DESC')
+        with contextlib.closing(_connect(self.path)) as connection:
+            return [dict(row) for row in connection.execute(sql, () if campaign is None else (campaign,))]
+
+    def entries(self, campaign=None, status=PENDING, limit=None):
+        """Dead letters as dicts, oldest first"""
+        self.flush()
+        conditions, params = ['status = ?'], [status]
+        if campaign is not None:
+            conditions.append('campaign = ?')
+            params.append(campaign)
+        sql = f"SELECT {', '.join(LIST_COLUMNS)} FROM dead_letters WHERE {' AND '.join(conditions)} ORDER BY id"
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with contextlib.closing(_connect(self.path)) as connection:
+            return [dict(row) for row in connection.execute(sql, params)]
+
+
+def _release_claims(dead_letters, owner, stop):
+    stop.set()
+    if dead_letters._writer.is_alive():
+        # Failures recorded by the replay must land before its claims go
+        dead_letters.flush()
+    with contextlib.closing(_connect(dead_letters.path)) as connection, connection:
+        connection.execute('UPDATE dead_letters SET claimed_by = NULL, claimed_until = NULL WHERE claimed_by = ?',
+                           (owner,))
+
+
+def _renew_claims(path, owner, stop):
+    # Runs on its own thread, so a replay stuck behind its rate limiter keeps its rows
+    while not stop.wait(REPLAY_LEASE / 3):
+        with contextlib.closing(_connect(path)) as connection, connection:
+            connection.execute('UPDATE dead_letters SET claimed_until = ? WHERE claimed_by = ? AND status = ?',
+                               (time.time() + REPLAY_LEASE, owner, PENDING))
+
+
+class ReplayClaim:
+    """The rows one replay has taken from a DeadLetterQueue.
+
+    Iterating reads retryable rows a page at a time, so memory stays flat.
+    Each page is claimed in the same transaction that reads it, so replays
+    running at the same time (in this process or another) never send the
+    same row twice. The claims are renewed in the background until
+    `release()`, which must only be called once every row read has been
+    sent; ReplayExecutor.run does this. Rows a replay didn't get to, or
+    whose claims it never released because it died, go back to the queue.
+    """
+
+    def __init__(self, dead_letters, campaign=None, max_attempts=None):
+        self.dead_letters = dead_letters
+        self.campaign = campaign
+        self.max_attempts = max_attempts
+        self.owner = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._renewer = None
+        # Also runs if the claim is dropped without being released
+        self._release = weakref.finalize(self, _release_claims, dead_letters, self.owner, self._stop)
+
+    def __iter__(self):
+        if self._renewer is None:
+            self._renewer = threading.Thread(target=_renew_claims, args=(self.dead_letters.path, self.owner, self._stop),
+                                             name='dead-letter-lease', daemon=True)
+            self._renewer.start()
+        last = ('', 0)
+        with contextlib.closing(_connect(self.dead_letters.path)) as connection:
+            # Transactions are opened explicitly so a page is read and claimed atomically
+            connection.isolation_level = None
+            while not self._stop.is_set():
+                where, params = self.dead_letters._replayable(self.campaign, self.max_attempts)
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    page = connection.execute(
+                        f"SELECT id, payload, recipient FROM dead_letters WHERE {where} "
+                        "AND (payload > ? OR (payload = ? AND id > ?)) ORDER BY payload, id LIMIT ?",
+                        params + [last[0], last[0], last[1], READ_PAGE_ROWS]).fetchall()
+                    connection.executemany(
+                        'UPDATE dead_letters SET claimed_by = ?, claimed_until = ? WHERE id = ?',
+                        [(self.owner, time.time() + REPLAY_LEASE, row['id']) for row in page])
+                    connection.execute('COMMIT')
+                except BaseException:
+                    connection.execute('ROLLBACK')
+                    raise
+                if not page:
+                    return
+                for row in page:
+                    yield {'email': row['recipient'], 'payload': row['payload']}
+                last = (page[-1]['payload'], page[-1]['id'])
+
+    def release(self):
+        """Give back every row still claimed; safe to call more than once"""
+        self._release()
+        if self._renewer is not None:
+            self._renewer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class ReplayExecutor(CampaignExecutor):
+    """CampaignExecutor that re-sends dead letters with their stored payloads.
+
+    Run it on `DeadLetterQueue.replayable()`; the message and subject are
+    ignored, and the claim on the rows is released once the last batch is
+    back. Recipients are batched per payload and go through the same
+    workers, rate limiter, suppression list and results store as a campaign.
+    Recipients that get through are marked replayed. Those that fail again
+    stay in the queue with their attempt count raised.
+    """
+
+    def __init__(self, mailer, dead_letters=None, **options):
+        if dead_letters is None:
+            raise ValueError("ReplayExecutor needs a DeadLetterQueue")
+        super().__init__(mailer, dead_letters=dead_letters, **options)
+
+    def run(self, message, subject, recipients):
+        try:
+            return super().run(message, subject, recipients)
+        finally:
+            # Only now is nothing of the replay in flight
+            release = getattr(recipients, 'release', None)
+            if release is not None:
+                release()
+
+    def work_items(self, message, subject, recipients, held=None):
+        for payload, rows in itertools.groupby(recipients, key=lambda row: row['payload']):
+            prepared = PreparedSend.from_suffix(self.mailer, self.dead_letters.payload(payload))
+            for chunk in chunked((row['email'] for row in rows), self.batch_size):
+                yield prepared, chunk, None
+
+    def _send(self, prepared, chunk, key, send_after=None):
+        batch_result = super()._send(prepared, chunk, key, send_after)
+        if batch_result.sent:
+            self.dead_letters.resolve(prepared.payload_id, batch_result.sent)
+        return batch_result
+
+
+def replay(args):
+    # Reuses the campaign runner's settings loading and progress lines
+    from cli import emit, load_settings
+    from onesignal_mailer import OneSignalMailer
+    from rate_limiter import TokenBucket
+
+    load_settings(args)
+    mailer = OneSignalMailer(pool_size=max(args.workers, 1))
+    if args.rate:
+        mailer.rate_limiter = TokenBucket(args.rate)
+
+    suppression = None
+    if args.suppression:
+        from suppression import SuppressionList
+        suppression = SuppressionList(args.suppression)
+
+    def on_result(batch_result, progress):
+        for recipient, error in batch_result.failed.items():
+            emit('failed', recipient=recipient, error=error)
+
+    dead_letters = DeadLetterQueue(args.db)
+    try:
+        total = dead_letters.count_replayable(args.campaign, args.max_attempts)
+        emit('start', replayable=total)
+        executor = ReplayExecutor(mailer, dead_letters=dead_letters, workers=args.workers,
+                                  batch_size=args.batch_size, suppression=suppression, on_result=on_result,
+                                  name=f"replay-{time.strftime('%Y%m%d-%H%M%S')}")
+        result = executor.run(None, None, dead_letters.replayable(args.campaign, args.max_attempts))
+    finally:
+        dead_letters.close()
+        if suppression is not None:
+            suppression.close()
+        mailer.close()
+    emit('done', attempted=result.total, sent=result.success_count, failed=result.failure_count,
+         suppressed=result.suppressed)
+    return 1 if result.failed else 0
+
+
+def main(argv=None):
+    from cli import SETTINGS_FILE
+
+    parser = argparse.ArgumentParser(description="Inspect and replay failed recipients.")
+    parser.add_argument('--db', default=DEFAULT_DEAD_LETTER_PATH,
+                        help=f"dead letter database (default: {DEFAULT_DEAD_LETTER_PATH})")
+    commands = parser.add_subparsers(dest='command', required=True)
+    summary = commands.add_parser('summary', help="counts by status and error class")
+    summary.add_argument('--campaign')
+    listing = commands.add_parser('list', help="pending dead letters")
+    listing.add_argument('--campaign')
+    listing.add_argument('--limit', type=int)
+    replay_parser = commands.add_parser('replay', help="re-send every retryable failure")
+    replay_parser.add_argument('--campaign', help="only this campaign's failures")
+    replay_parser.add_argument('--max-attempts', type=int, help="skip recipients already tried this many times")
+    replay_parser.add_argument('--rate', type=float, default=0, help="maximum recipients per second (default: 0)")
+    replay_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                               help=f"concurrent requests (default: {DEFAULT_WORKERS})")
+    replay_parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE,
+                               help=f"recipients per request (default: {MAX_BATCH_SIZE})")
+    replay_parser.add_argument('--suppression', help="suppression list index to screen recipients against")
+    replay_parser.add_argument('--env-file', default='.env', help="file with OneSignal settings (default: .env)")
+    replay_parser.add_argument('--settings', default=SETTINGS_FILE,
+                               help=f"GUI settings file used when variables are unset (default: {SETTINGS_FILE})")
+    args = parser.parse_args(argv)
+
+    if args.command == 'replay':
+        return replay(args)
+
+    dead_letters = DeadLetterQueue(args.db)
+    try:
+        if args.command == 'summary':
+            rows = dead_letters.summary(args.campaign)
+        else:
+            rows = dead_letters.entries(args.campaign, limit=args.limit)
+    finally:
+        dead_letters.close()
+    for row in rows:
+        print(json.dumps(row))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import time
+from collections import deque
+
+from rate_limiter import TokenBucket
+from recipients import recipient_email
+
+# Recipients held back for reordering; the look-ahead that lets domains be mixed
+DEFAULT_DOMAIN_BUFFER = 10000
+
+# Longest single sleep while waiting on a stop event (seconds)
+POLL_INTERVAL = 0.2
+
+
+def recipient_domain(address):
+    """Lower-cased domain of an address, '' if it has none"""
+    _, at, domain = address.rpartition('@')
+    return domain.strip().rstrip('.').lower() if at else ''
+
+
+class DomainScheduler:
+    """Reorders a recipient stream so no mailbox provider gets a burst.
+
+    Up to `buffer_size` recipients are held in per-domain queues and
+    released one domain at a time, round-robin, so a block of 50k gmail.com
+    addresses in the input comes out interleaved with everything else read
+    around it. Memory stays bounded by the buffer; a block of one domain
+    larger than the buffer can only be spread over what the buffer holds.
+
+    `domain_rates` caps individual domains in recipients per second, e.g.
+    {'gmail.com': 50}, and `default_rate` caps every other domain. While a
+    domain is at its cap the others keep flowing; the stream only waits
+    when every buffered domain is capped. Caps limit how fast recipients
+    are released to batching, which runs at most a few requests ahead of
+    sending.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_DOMAIN_BUFFER, domain_rates=None, default_rate=None):
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be at least 1")
+        self.buffer_size = buffer_size
+        self.domain_rates = {}
+        for domain, rate in (domain_rates or {}).items():
+            if rate <= 0:
+                raise ValueError(f"Rate for {domain} must be positive")
+            self.domain_rates[domain.strip().lower()] = rate
+        if default_rate is not None and default_rate <= 0:
+            raise ValueError("default_rate must be positive")
+        self.default_rate = default_rate
+
+        # Seconds spent waiting because every buffered domain was at its cap
+        self.waited = 0.0
+
+    def _bucket(self, domain, buckets):
+        bucket = buckets.get(domain)
+        if bucket is None:
+            rate = self.domain_rates.get(domain, self.default_rate)
+            if rate is None:
+                return None
+            bucket = buckets[domain] = TokenBucket(rate)
+        return bucket
+
+    def schedule(self, recipients, stop_event=None):
+        """Yield `recipients` interleaved by domain and within the caps.
+
+        Stops early, leaving the rest unread, if `stop_event` is set while
+        waiting on a cap.
+        """
+        source = iter(recipients)
+        exhausted = False
+        queues = {}
+        # Domains with buffered recipients, next in line first
+        rotation = deque()
+        buckets = {}
+        buffered = 0
+
+        while True:
+            # Keep the buffer full so there is a choice of domains
+            while not exhausted and buffered < self.buffer_size:
+                try:
+                    recipient = next(source)
+                except StopIteration:
+                    exhausted = True
+                    break
+                domain = recipient_domain(recipient_email(recipient))
+                queue = queues.get(domain)
+                if queue is None:
+                    queue = queues[domain] = deque()
+                    rotation.append(domain)
+                queue.append(recipient)
+                buffered += 1
+            if not rotation:
+                return
+
+            wait = None
+            for _ in range(len(rotation)):
+                domain = rotation[0]
+                rotation.rotate(-1)
+                bucket = self._bucket(domain, buckets)
+                delay = bucket.reserve() if bucket is not None else 0.0
+                if delay == 0.0:
+                    break
+                wait = delay if wait is None else min(wait, delay)
+            else:
+                # Every buffered domain is at its cap
+                started = time.monotonic()
+                if stop_event is None:
+                    time.sleep(wait)
+                elif stop_event.wait(min(wait, POLL_INTERVAL)):
+                    return
+                self.waited += time.monotonic() - started
+                continue
+
+            queue = queues[domain]
+            recipient = queue.popleft()
+            buffered -= 1
+            if not queue:
+                # The domain was just rotated to the back
+                rotation.pop()
+                del queues[domain]
+                if domain not in self.domain_rates:
+                    # Long tails of small domains would otherwise keep a bucket each
+                    buckets.pop(domain, None)
+            yield recipient
@@ -1,12 +1,70 @@
 import customtkinter as ctk
-from tkinter import messagebox, scrolledtext
-from onesignal_mailer import OneSignalMailer
+from tkinter import messagebox, scrolledtext, filedialog
+from onesignal_mailer import OneSignalMailer, MAX_BATCH_SIZE, chunked
+from campaign import CampaignExecutor, DEFAULT_WORKERS
+from recipients import RecipientFile, parse_recipient_text, recipient_email
+from validation import RecipientValidator
+from suppression import SuppressionList, DEFAULT_SUPPRESSION_PATH
+from journal import CampaignJournal, JOURNAL_DIR, content_id, load_journal
+from scheduling import SlotPlanner
+from results import ResultsStore, DEFAULT_RESULTS_PATH
+from domains import DomainScheduler
+from manager import CampaignManager, PAUSED, RUNNING
+from deadletter import DeadLetterQueue, ReplayExecutor, DEFAULT_DEAD_LETTER_PATH
 import logging
+import logging.handlers
 from datetime import datetime
 import os
-import time
-import threading
 import json
+import queue
+
+# Recipients shown in the textbox when a file is loaded
+RECIPIENT_PREVIEW_LINES = 10
+
+# The activity log keeps only the most recent lines
+LOG_VIEWER_MAX_LINES = 1000
+
+# How often the Tk loop drains queued UI events (ms), and how many per pass
+UI_POLL_INTERVAL = 100
+UI_EVENTS_PER_POLL = 500
+
+# Failed recipients listed in the end-of-campaign dialog
+FAILED_PREVIEW_COUNT = 20
+
+# How often the campaign list is refreshed (ms)
+CAMPAIGN_REFRESH_INTERVAL = 1000
+
+# Priority choices and their weight in sharing the send rate
+PRIORITY_WEIGHTS = {"Low": 1, "Normal": 2, "High": 4, "Urgent": 8}
+DEFAULT_PRIORITY = "Normal"
+
+# Seconds to wait for campaigns to stop when the window is closed
+SHUTDOWN_TIMEOUT = 30
+
+# Log file, rotated once it reaches LOG_MAX_BYTES
+LOG_FILE = os.path.join('logs', 'email_sender.log')
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# Lines of previous logs shown at startup
+LOG_TAIL_LINES = 50
+LOG_TAIL_BLOCK_SIZE = 8192
+
+
+def tail_lines(path, count, block_size=LOG_TAIL_BLOCK_SIZE):
+    """Last `count` lines of a file, read backwards from the end in blocks"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        # One extra newline so the first kept line is complete
+        while position > 0 and data.count(b'\n') <= count:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+    return lines[-count:]
 
 # Set appearance mode and default color theme
 ctk.set_appearance_mode("light")
@@ -30,6 +88,57 @@ class PageHeader(ctk.CTkFrame):
         self.separator = ctk.CTkFrame(self, height=2, fg_color=("gray70", "gray30"))
         self.separator.grid(row=1, column=0, sticky="ew", padx=10, pady=(0, 10))
 
+class CampaignRow(ctk.CTkFrame):
+    """One campaign in the campaign list, with its progress and controls"""
+
+    def __init__(self, parent, campaign):
+        super().__init__(parent)
+        self.campaign = campaign
+        self.grid_columnconfigure(0, weight=1)
+
+        ctk.CTkLabel(self, text=campaign.subject, anchor="w",
+                     font=ctk.CTkFont(weight="bold")).grid(row=0, column=0, sticky="ew", padx=10, pady=(5, 0))
+        self.pause_button = ctk.CTkButton(self, text="Pause", width=80, command=self.toggle_pause)
+        self.pause_button.grid(row=0, column=1, rowspan=3, padx=(10, 5))
+        self.cancel_button = ctk.CTkButton(self, text="Cancel", width=80, command=self.cancel,
+                                           fg_color="red", hover_color="dark red")
+        self.cancel_button.grid(row=0, column=2, rowspan=3, padx=(5, 10))
+
+        self.progress_bar = ctk.CTkProgressBar(self)
+        self.progress_bar.grid(row=1, column=0, sticky="ew", padx=10, pady=2)
+        self.status = ctk.CTkLabel(self, text="", anchor="w")
+        self.status.grid(row=2, column=0, sticky="ew", padx=10, pady=(0, 5))
+        self.refresh()
+
+    def toggle_pause(self):
+        if self.campaign.state == PAUSED:
+            self.campaign.resume()
+        else:
+            self.campaign.pause()
+        self.refresh()
+
+    def cancel(self):
+        self.campaign.cancel()
+        self.refresh()
+
+    def refresh(self):
+        campaign = self.campaign
+        total = max(campaign.total or 0, campaign.attempted)
+        self.progress_bar.set(min(campaign.attempted / total, 1.0) if total else 0)
+
+        text = f"{campaign.state.capitalize()}: {campaign.attempted:,} of {total:,} processed"
+        if campaign.failed:
+            text += f", {campaign.failed:,} failed"
+        if campaign.active:
+            text += f", {campaign.throughput():,.1f} emails/second"
+        self.status.configure(text=text)
+
+        controllable = campaign.state in (RUNNING, PAUSED)
+        self.pause_button.configure(text="Resume" if campaign.state == PAUSED else "Pause",
+                                    state="normal" if controllable else "disabled")
+        self.cancel_button.configure(state="normal" if controllable else "disabled")
+
+
 class SettingsFrame(ctk.CTkFrame):
     def __init__(self, parent, mailer):
         super().__init__(parent)
@@ -122,7 +231,8 @@ class TemplateEditorFrame(ctk.CTkFrame):
         # Instructions
         instructions = ctk.CTkLabel(
             self, 
-            text="Create and edit email templates. Use {name} as a placeholder for recipient names.",
+            text="Create and edit email templates. Use {message}, {subject} and {sender_name} for campaign values, "
+                 "and any other placeholder such as {name} as a merge field filled from the recipient's data row.",
             wraplength=600,
             justify="left"
         )
@@ -151,16 +261,18 @@ class TemplateEditorFrame(ctk.CTkFrame):
             return
         
         try:
-            # Verify template format
-            test_str = template.format(
-                message="Test message",
-                subject="Test subject",
-                sender_name="Test sender"
-            )
-            
-            # Save template
+            # Compiling the template verifies its placeholders
             self.mailer.set_email_template(template)
-            messagebox.showinfo("Success", "Template saved successfully!")
+            saved = ""
+            merge_fields = sorted(self.mailer.merge_fields())
+            if merge_fields:
+                # Anything but the campaign fields is filled from recipient columns; a typo lands here too
+                placeholders = ', '.join(f"{{{field}}}" for field in merge_fields)
+                saved += (f"\n\nMerge fields: {placeholders}. Each must be a column of the recipient list, "
+                          "or the campaign won't start.")
+            if self.mailer.body_bytes_saved:
+                saved += f"\n\nMinifying saves {self.mailer.body_bytes_saved} bytes per request."
+            messagebox.showinfo("Success", f"Template saved successfully!{saved}")
             
         except KeyError as e:
             messagebox.showerror("Error", f"Invalid placeholder in template: {str(e)}")
@@ -195,6 +307,9 @@ class EmailSenderGUI:
         self.settings_frame = SettingsFrame(self.root, self.mailer)
         self.template_frame = TemplateEditorFrame(self.root, self.mailer)
         
+        # Worker threads never touch widgets; they queue events for the Tk loop
+        self.ui_events = queue.SimpleQueue()
+
         # Create main content
         self.create_main_content()
         
@@ -204,12 +319,14 @@ class EmailSenderGUI:
         # Load existing logs
         self.load_existing_logs()
         
-        # Initialize flags
-        self.stop_flag = False
-        self.sending_thread = None
+        # Rows of the campaign list, by campaign
+        self.campaign_rows = {}
         
         # Show main frame by default
         self.show_frame("main")
+
+        self.root.after(UI_POLL_INTERVAL, self.process_ui_events)
+        self.root.after(CAMPAIGN_REFRESH_INTERVAL, self.refresh_campaigns)
         
     def create_sidebar(self):
         # Create sidebar frame
@@ -259,8 +376,27 @@ class EmailSenderGUI:
         
         # Recipients
         ctk.CTkLabel(form_frame, text="Recipients:").grid(row=0, column=0, sticky="w", padx=20, pady=10)
-        self.recipients = ctk.CTkTextbox(form_frame, height=100)
-        self.recipients.grid(row=0, column=1, sticky="ew", padx=(0, 20), pady=10)
+        recipients_frame = ctk.CTkFrame(form_frame, fg_color="transparent")
+        recipients_frame.grid(row=0, column=1, sticky="ew", padx=(0, 20), pady=10)
+        recipients_frame.grid_columnconfigure(0, weight=1)
+
+        self.recipients = ctk.CTkTextbox(recipients_frame, height=100)
+        self.recipients.grid(row=0, column=0, columnspan=3, sticky="ew")
+
+        # Large lists are streamed from a file; only a count and preview are shown
+        self.recipient_file = None
+        self.recipient_file_label = ctk.CTkLabel(recipients_frame, text="", anchor="w")
+        self.recipient_file_label.grid(row=1, column=0, sticky="w", pady=(5, 0))
+        self.load_file_button = ctk.CTkButton(recipients_frame, text="Load File...", width=100,
+                                              command=self.load_recipient_file)
+        self.load_file_button.grid(row=1, column=1, padx=(10, 0), pady=(5, 0))
+        self.clear_file_button = ctk.CTkButton(recipients_frame, text="Clear File", width=100,
+                                               command=self.clear_recipient_file, fg_color="gray",
+                                               state="disabled")
+        self.clear_file_button.grid(row=1, column=2, padx=(10, 0), pady=(5, 0))
+        self.import_unsubscribes_button = ctk.CTkButton(recipients_frame, text="Import Unsubscribes...",
+                                                        width=150, command=self.import_unsubscribes)
+        self.import_unsubscribes_button.grid(row=1, column=3, padx=(10, 0), pady=(5, 0))
         
         # Subject
         ctk.CTkLabel(form_frame, text="Subject:").grid(row=1, column=0, sticky="w", padx=20, pady=10)
@@ -272,29 +408,62 @@ class EmailSenderGUI:
         self.message = ctk.CTkTextbox(form_frame, height=200)
         self.message.grid(row=2, column=1, sticky="ew", padx=(0, 20), pady=10)
         
-        # Interval
-        interval_frame = ctk.CTkFrame(form_frame)
-        interval_frame.grid(row=3, column=1, sticky="w", padx=(0, 20), pady=10)
-        
-        ctk.CTkLabel(interval_frame, text="Interval (seconds):").pack(side="left", padx=(0, 10))
-        self.interval = ctk.CTkEntry(interval_frame, width=100)
-        self.interval.pack(side="left")
-        self.interval.insert(0, "5")
+        # Rate
+        rate_frame = ctk.CTkFrame(form_frame)
+        rate_frame.grid(row=3, column=1, sticky="w", padx=(0, 20), pady=10)
+
+        ctk.CTkLabel(rate_frame, text="Account rate (emails/second, 0 = unlimited):").pack(side="left", padx=(0, 10))
+        self.rate = ctk.CTkEntry(rate_frame, width=100)
+        self.rate.pack(side="left")
+        self.rate.insert(0, "0.2")
+
+        ctk.CTkLabel(rate_frame, text="Workers:").pack(side="left", padx=(20, 10))
+        self.workers = ctk.CTkEntry(rate_frame, width=60)
+        self.workers.pack(side="left")
+        self.workers.insert(0, str(DEFAULT_WORKERS))
+
+        # Submit everything now and let OneSignal deliver at the chosen rate
+        self.schedule_on_server = ctk.CTkCheckBox(rate_frame, text="Schedule delivery on OneSignal")
+        self.schedule_on_server.pack(side="left", padx=(20, 0))
+
+        # Round-robin over recipient domains so no mailbox provider gets a burst
+        self.interleave_domains = ctk.CTkCheckBox(rate_frame, text="Mix recipient domains")
+        self.interleave_domains.pack(side="left", padx=(20, 0))
+        self.interleave_domains.select()
         
         # Buttons
         button_frame = ctk.CTkFrame(form_frame, bg_color="transparent")
         button_frame.grid(row=4, column=1, sticky="e", padx=(0, 20), pady=20)
         
+        # Campaigns share the account rate in proportion to their priority
+        ctk.CTkLabel(button_frame, text="Priority:").pack(side="left", padx=(10, 5))
+        self.priority = ctk.CTkOptionMenu(button_frame, values=list(PRIORITY_WEIGHTS), width=100)
+        self.priority.pack(side="left")
+        self.priority.set(DEFAULT_PRIORITY)
+
         self.start_button = ctk.CTkButton(button_frame, text="Start Campaign", command=self.start_sending)
         self.start_button.pack(side="left", padx=10)
-        
-        self.stop_button = ctk.CTkButton(button_frame, text="Stop", command=self.stop_sending,
-                                       fg_color="gray", state="disabled")
-        self.stop_button.pack(side="left", padx=10)
+
+        self.replay_button = ctk.CTkButton(button_frame, text="Replay Failed", command=self.replay_failed,
+                                           fg_color="gray")
+        self.replay_button.pack(side="left")
+
+        # Campaign list
+        campaigns_frame = ctk.CTkFrame(self.main_frame)
+        campaigns_frame.grid(row=2, column=0, padx=20, pady=(0, 20), sticky="nsew")
+
+        campaigns_header = ctk.CTkFrame(campaigns_frame, fg_color="transparent")
+        campaigns_header.pack(fill="x", padx=10, pady=(10, 5))
+        ctk.CTkLabel(campaigns_header, text="Campaigns", font=ctk.CTkFont(weight="bold")).pack(side="left")
+        ctk.CTkButton(campaigns_header, text="Clear Finished", width=100, fg_color="gray",
+                      command=self.clear_finished_campaigns).pack(side="right")
+
+        self.campaign_list = ctk.CTkScrollableFrame(campaigns_frame, height=150)
+        self.campaign_list.pack(fill="x", padx=10, pady=(0, 10))
         
         # Log Frame
         log_frame = ctk.CTkFrame(self.main_frame)
-        log_frame.grid(row=2, column=0, padx=20, pady=(0, 20), sticky="nsew")
+        log_frame.grid(row=3, column=0, padx=20, pady=(0, 20), sticky="nsew")
         
         ctk.CTkLabel(log_frame, text="Activity Log", font=ctk.CTkFont(weight="bold")).pack(pady=(10, 5), padx=10, anchor="w")
         
@@ -310,35 +479,98 @@ class EmailSenderGUI:
         self.logger = logging.getLogger('EmailSender')
         self.logger.setLevel(logging.INFO)
 
-        # Create handlers
-        log_file = os.path.join('logs', 'email_sender.log')
-        file_handler = logging.FileHandler(log_file)
+        # The file is written by a background listener so sending threads
+        # only pay for a queue put
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
         
         # Create formatters
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         file_handler.setFormatter(formatter)
 
+        log_queue = queue.SimpleQueue()
+        self.log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+        self.log_listener.start()
+
         # Add handlers to logger
-        self.logger.addHandler(file_handler)
+        self.logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    def stop_logging(self):
+        # Flush queued records to the file
+        self.log_listener.stop()
+        self.log_listener.handlers[0].close()
 
     def load_existing_logs(self):
         try:
-            log_file = os.path.join('logs', 'email_sender.log')
-            if os.path.exists(log_file):
-                with open(log_file, 'r') as f:
-                    # Get last 50 lines of logs
-                    lines = f.readlines()[-50:]
-                    self.update_log_viewer(''.join(lines))
+            if os.path.exists(LOG_FILE):
+                # Get last lines of logs without reading the whole file
+                self.update_log_viewer(''.join(tail_lines(LOG_FILE, LOG_TAIL_LINES)))
         except Exception as e:
             self.logger.error(f"Error loading existing logs: {str(e)}")
 
     def update_log_viewer(self, message):
         self.log_viewer.config(state="normal")
         self.log_viewer.insert(ctk.END, message)
+
+        # Drop the oldest lines so the textbox stays small
+        line_count = int(self.log_viewer.index("end-1c").split(".")[0])
+        if line_count > LOG_VIEWER_MAX_LINES:
+            self.log_viewer.delete("1.0", f"{line_count - LOG_VIEWER_MAX_LINES + 1}.0")
+
         self.log_viewer.see(ctk.END)  # Scroll to the bottom
         self.log_viewer.config(state="disabled")
 
-    def log_and_display(self, message, level='info'):
+    def refresh_campaigns(self):
+        # Throughput and progress are read from the manager on a timer
+        self.root.after(CAMPAIGN_REFRESH_INTERVAL, self.refresh_campaigns)
+        self.update_campaign_list()
+
+    def update_campaign_list(self):
+        campaigns = self.manager.campaigns()
+        for campaign in campaigns:
+            row = self.campaign_rows.get(campaign)
+            if row is None:
+                row = self.campaign_rows[campaign] = CampaignRow(self.campaign_list, campaign)
+                row.pack(fill="x", padx=5, pady=5)
+            else:
+                row.refresh()
+        for campaign in set(self.campaign_rows) - set(campaigns):
+            self.campaign_rows.pop(campaign).destroy()
+        # One replay at a time; its claimed rows would be skipped by a second one anyway
+        replaying = any(isinstance(campaign.executor, ReplayExecutor) and campaign.active for campaign in campaigns)
+        self.replay_button.configure(state="disabled" if replaying else "normal")
+
+    def clear_finished_campaigns(self):
+        self.manager.clear_finished()
+        self.update_campaign_list()
+
+    def process_ui_events(self):
+        # Apply queued events in one batch: a single textbox insert for all log lines
+        self.root.after(UI_POLL_INTERVAL, self.process_ui_events)
+
+        lines = []
+        calls = []
+        for _ in range(UI_EVENTS_PER_POLL):
+            try:
+                kind, value = self.ui_events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'log':
+                lines.append(value)
+            else:
+                calls.append(value)
+
+        if lines:
+            self.update_log_viewer(''.join(lines[-LOG_VIEWER_MAX_LINES:]))
+        for call in calls:
+            call()
+
+    def run_in_ui(self, func):
+        """Run func on the Tk thread; safe to call from any thread"""
+        self.ui_events.put(('call', func))
+
+    def log_and_display(self, message, level='info', display=True):
         # Get current timestamp
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         log_message = f"{timestamp} - {message}\n"
@@ -351,26 +583,108 @@ class EmailSenderGUI:
         elif level == 'warning':
             self.logger.warning(message)
             
-        # Update log viewer
-        self.update_log_viewer(log_message)
+        # Queue for the log viewer; safe from any thread
+        if display:
+            self.ui_events.put(('log', log_message))
 
-    def get_interval_seconds(self):
+    def get_rate(self):
         try:
-            value = float(self.interval.get())
+            value = float(self.rate.get())
             if value < 0:
-                raise ValueError("Interval must be non-negative")
+                raise ValueError("Rate must be non-negative")
             return value
-        except ValueError as e:
-            raise ValueError("Please enter a valid number for the interval")
+        except ValueError:
+            raise ValueError("Please enter a valid number for the rate")
+
+    def get_worker_count(self):
+        try:
+            value = int(self.workers.get())
+            if value < 1:
+                raise ValueError("Workers must be at least 1")
+            return value
+        except ValueError:
+            raise ValueError("Please enter a whole number of workers (1 or more)")
+
+    def load_recipient_file(self):
+        path = filedialog.askopenfilename(
+            title="Select recipients file",
+            filetypes=[("Recipient files", "*.csv *.txt"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+
+        try:
+            recipient_file = RecipientFile(path)
+            count = recipient_file.estimated_count()
+            preview = recipient_file.preview(RECIPIENT_PREVIEW_LINES)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not read recipients file: {str(e)}")
+            self.log_and_display(f"Could not read recipients file {path}: {str(e)}", 'error')
+            return
+
+        self.recipient_file = recipient_file
+        preview_text = "\n".join(recipient_email(recipient) for recipient in preview)
+        if count > len(preview):
+            preview_text += "\n..."
+
+        self.recipients.config(state="normal")
+        self.recipients.delete("1.0", ctk.END)
+        self.recipients.insert("1.0", preview_text)
+        self.recipients.config(state="disabled")
+        self.recipient_file_label.configure(
+            text=f"{os.path.basename(path)}: about {count:,} recipients (showing the first {len(preview)})"
+        )
+        self.clear_file_button.configure(state="normal")
+        self.log_and_display(f"Loaded recipients file {path} with about {count:,} recipients")
+
+    def clear_recipient_file(self):
+        self.recipient_file = None
+        self.recipients.config(state="normal")
+        self.recipients.delete("1.0", ctk.END)
+        self.recipient_file_label.configure(text="")
+        self.clear_file_button.configure(state="disabled")
+
+    def import_unsubscribes(self):
+        path = filedialog.askopenfilename(
+            title="Select unsubscribed or bounced addresses",
+            filetypes=[("Recipient files", "*.csv *.txt"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+
+        try:
+            added = 0
+            for block in chunked(map(recipient_email, RecipientFile(path)), MAX_BATCH_SIZE):
+                added += self.suppression.add_many(block)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not import unsubscribes: {str(e)}")
+            self.log_and_display(f"Could not import unsubscribes from {path}: {str(e)}", 'error')
+            return
+
+        message = f"Added {added:,} addresses to the suppression list ({len(self.suppression):,} total)"
+        messagebox.showinfo("Success", message)
+        self.log_and_display(message)
 
     def start_sending(self):
         # Get values from fields
-        recipients = [email.strip() for email in self.recipients.get("1.0", ctk.END).splitlines() if email.strip()]
+        if self.recipient_file is not None:
+            # Streamed straight from disk by the sending thread
+            recipients = self.recipient_file
+            total_recipients = recipients.estimated_count()
+        else:
+            # One address per line, or CSV with an email column plus merge fields
+            try:
+                recipients = parse_recipient_text(self.recipients.get("1.0", ctk.END))
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                self.log_and_display(f"Email sending failed: {str(e)}", 'error')
+                return
+            total_recipients = len(recipients)
         subject_text = self.subject.get().strip()
         message_text = self.message.get("1.0", ctk.END).strip()
 
         # Validate inputs
-        if not recipients:
+        if not total_recipients:
             messagebox.showerror("Error", "Please enter at least one email address")
             self.log_and_display("Email sending failed: No recipients specified", 'error')
             return
@@ -380,99 +694,215 @@ class EmailSenderGUI:
             return
 
         try:
-            interval = self.get_interval_seconds()
+            rate = self.get_rate()
+            workers = self.get_worker_count()
         except ValueError as e:
             messagebox.showerror("Error", str(e))
             self.log_and_display(f"Email sending failed: {str(e)}", 'error')
             return
 
-        # Disable input fields and send button, enable stop button
-        self.recipients.config(state="disabled")
-        self.subject.config(state="disabled")
-        self.message.config(state="disabled")
-        self.interval.config(state="disabled")
-        self.start_button.config(state="disabled")
-        self.stop_button.config(state="normal")
-        self.stop_flag = False
-
-        # Start sending thread
-        self.sending_thread = threading.Thread(
-            target=self.send_emails_with_interval,
-            args=(recipients, subject_text, message_text, interval)
+        # A journal per campaign lets an interrupted run resume without double-sending
+        try:
+            journal = self.open_journal(recipients, subject_text, message_text)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not open campaign journal: {str(e)}")
+            self.log_and_display(f"Email sending failed: could not open campaign journal: {str(e)}", 'error')
+            return
+
+        self.start_campaign(recipients, subject_text, message_text, rate, workers, total_recipients, journal,
+                            bool(self.schedule_on_server.get()), bool(self.interleave_domains.get()),
+                            self.priority.get())
+
+        # The campaign keeps its own copy, so the form is free for the next one
+        self.clear_recipient_file()
+        self.subject.delete(0, ctk.END)
+        self.message.delete("1.0", ctk.END)
+
+    def open_journal(self, recipients, subject_text, message_text):
+        if isinstance(recipients, RecipientFile):
+            source = f"{os.path.abspath(recipients.path)}:{recipients.size}"
+        else:
+            source = json.dumps(recipients, sort_keys=True)
+        content = content_id(subject_text, message_text, self.mailer.get_email_template(), source)
+        path = os.path.join(JOURNAL_DIR, f"{content}.journal")
+        for campaign in self.manager.active():
+            if campaign.executor.journal is not None and campaign.executor.journal.path == path:
+                raise ValueError("This campaign is already running")
+
+        state = load_journal(path)
+        resume = False
+        if state.campaign_id and not state.done:
+            resume = messagebox.askyesno(
+                "Resume Campaign",
+                f"This campaign was interrupted after {len(state.sent):,} recipients were sent.\n\n"
+                "Resume and skip them? Choose No to start over and send to everyone."
+            )
+        return CampaignJournal(path, content=content, resume=resume)
+
+    def start_campaign(self, recipients, subject_text, message_text, rate, workers=DEFAULT_WORKERS,
+                       total_recipients=None, journal=None, schedule=False, interleave_domains=False,
+                       priority=DEFAULT_PRIORITY):
+        if total_recipients is None:
+            total_recipients = len(recipients)
+        failed_recipients = []
+
+        def on_result(result, progress):
+            for recipient, error in result.failed.items():
+                if len(failed_recipients) < FAILED_PREVIEW_COUNT:
+                    failed_recipients.append(f"{recipient} ({error})")
+                # Every failure goes to the log file; the viewer gets one line per batch
+                self.log_and_display(f"Failed to send email to {recipient}: {error}", 'error', display=False)
+
+            if result.error is not None:
+                self.log_and_display(f"Failed to send batch of {len(result.recipients)}: {str(result.error)}", 'error')
+            else:
+                self.logger.info(f"Successfully sent batch to {len(result.sent)} recipients "
+                                 f"({progress.total}/{total_recipients}) for '{subject_text}'")
+                if result.failed:
+                    self.log_and_display(f"{len(result.failed)} recipients in a batch were rejected "
+                                         f"(see the log file for addresses)", 'error')
+
+        rate_text = f"{rate} emails/second" if rate else "no rate limit"
+        planner = None
+        if schedule and rate:
+            # OneSignal does the spacing, so this campaign doesn't draw on the shared rate
+            rate_text += ", delivery scheduled on OneSignal"
+            planner = SlotPlanner(rate * 3600)
+        else:
+            # One rate for the whole account, shared by every running campaign
+            self.manager.set_rate(rate)
+
+        def on_finish(campaign):
+            self.report_campaign(campaign, failed_recipients, total_recipients, journal, planner)
+
+        campaign = self.manager.start(
+            message_text,
+            subject_text,
+            recipients,
+            weight=PRIORITY_WEIGHTS[priority],
+            total=total_recipients,
+            on_result=on_result,
+            on_finish=on_finish,
+            workers=workers,
+            batch_size=MAX_BATCH_SIZE,
+            validator=RecipientValidator(),
+            suppression=self.suppression,
+            journal=journal,
+            planner=planner,
+            results=self.results,
+            domain_scheduler=DomainScheduler() if interleave_domains else None,
+            dead_letters=self.dead_letters,
         )
-        self.sending_thread.start()
-
-    def stop_sending(self):
-        self.stop_flag = True
-        self.log_and_display("Stopping email sending process...", 'warning')
-
-    def toggle_input_state(self, state):
-        self.recipients.config(state=state)
-        self.subject.config(state=state)
-        self.message.config(state=state)
-        self.interval.config(state=state)
-        self.start_button.config(state=state)
-
-    def send_emails_with_interval(self, recipients, subject_text, message_text, interval):
-        total_recipients = len(recipients)
-        success_count = 0
+        self.log_and_display(f"Started campaign '{subject_text}' to {total_recipients} recipients "
+                             f"with {workers} worker(s), {rate_text} and {priority.lower()} priority")
+        self.update_campaign_list()
+
+    def replay_failed(self):
+        if any(isinstance(campaign.executor, ReplayExecutor) for campaign in self.manager.active()):
+            messagebox.showinfo("Replay Failed", "A replay is already running.")
+            return
+        try:
+            rate = self.get_rate()
+            workers = self.get_worker_count()
+            count = self.dead_letters.count_replayable()
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if not count:
+            messagebox.showinfo("Replay Failed", "There are no failed recipients worth retrying.")
+            return
+        if not messagebox.askyesno("Replay Failed",
+                                   f"Re-send to {count:,} recipients whose earlier sends failed with a "
+                                   "temporary error?"):
+            return
+
         failed_recipients = []
 
+        def on_result(result, progress):
+            for recipient, error in result.failed.items():
+                if len(failed_recipients) < FAILED_PREVIEW_COUNT:
+                    failed_recipients.append(f"{recipient} ({error})")
+                self.log_and_display(f"Replay to {recipient} failed again: {error}", 'error', display=False)
+
+        def on_finish(campaign):
+            self.report_campaign(campaign, failed_recipients, count)
+
+        # Replays share the account rate like any other campaign
+        self.manager.set_rate(rate)
+        self.manager.start(
+            None,
+            "Replay of failed recipients",
+            self.dead_letters.replayable(),
+            weight=PRIORITY_WEIGHTS[self.priority.get()],
+            total=count,
+            on_result=on_result,
+            on_finish=on_finish,
+            executor_class=ReplayExecutor,
+            workers=workers,
+            batch_size=MAX_BATCH_SIZE,
+            suppression=self.suppression,
+            results=self.results,
+            dead_letters=self.dead_letters,
+        )
+        self.log_and_display(f"Started replaying {count:,} failed recipients")
+        self.update_campaign_list()
+
+    def report_campaign(self, managed, failed_recipients, total_recipients, journal=None, planner=None):
+        """Log and show how a campaign ended; runs on the campaign's thread"""
+        finished = False
         try:
-            self.log_and_display(f"Starting to send emails to {total_recipients} recipients with {interval} seconds interval")
-            
-            for i, recipient in enumerate(recipients, 1):
-                if self.stop_flag:
-                    self.log_and_display("Email sending process stopped by user", 'warning')
-                    break
-
-                self.log_and_display(f"Sending email to {recipient} ({i}/{total_recipients})...")
-                
-                try:
-                    # Send email
-                    response = self.mailer.send_mail(
-                        message=message_text,
-                        subject=subject_text,
-                        recipient_email=recipient
-                    )
-                    success_count += 1
-                    self.log_and_display(f"Successfully sent email to {recipient}")
-                    
-                    # Wait for interval if not the last email and not stopped
-                    if i < total_recipients and not self.stop_flag:
-                        self.log_and_display(f"Waiting {interval} seconds before sending next email...")
-                        time.sleep(interval)
-                        
-                except Exception as e:
-                    error_msg = f"Failed to send email to {recipient}: {str(e)}"
-                    failed_recipients.append(f"{recipient} ({str(e)})")
-                    self.log_and_display(error_msg, 'error')
-
-            # Show results
-            if success_count == total_recipients:
-                success_msg = f"All {success_count} emails sent successfully!"
-                messagebox.showinfo("Success", success_msg)
+            if managed.error is not None:
+                raise managed.error
+            campaign = managed.result
+            title = f"Campaign '{managed.subject}'"
+            self.log_and_display(f"Delivery results for campaign {managed.name} saved to {DEFAULT_RESULTS_PATH}")
+            success_count = campaign.success_count
+            finished = not campaign.stopped
+
+            if planner is not None and planner.planned:
+                self.log_and_display(f"Delivery of {planner.planned} emails scheduled between "
+                                     f"{planner.start:%Y-%m-%d %H:%M} and {planner.end:%Y-%m-%d %H:%M} UTC")
+
+            if campaign.already_sent:
+                self.log_and_display(f"Resumed campaign: skipped {campaign.already_sent} recipients already sent")
+
+            validation = campaign.validation
+            if validation is not None and validation.rejected:
+                self.log_and_display(f"Recipient check: {validation.summary()}", 'warning')
+            if campaign.suppressed:
+                self.log_and_display(f"Skipped {campaign.suppressed} suppressed (unsubscribed or bounced) recipients",
+                                     'warning')
+
+            if campaign.stopped:
+                self.log_and_display(f"{title} cancelled by user after {success_count} emails", 'warning')
+            elif not campaign.failed:
+                success_msg = f"{title}: all {success_count} emails sent successfully!"
+                if validation is not None and validation.rejected:
+                    success_msg += (f" Skipped {validation.rejected_count} invalid or duplicate "
+                                    f"addresses ({validation.summary()}).")
                 self.log_and_display(success_msg)
-                # Clear fields only if all emails were sent successfully
-                self.recipients.delete("1.0", ctk.END)
-                self.subject.delete(0, ctk.END)
-                self.message.delete("1.0", ctk.END)
+                self.run_in_ui(lambda: messagebox.showinfo("Success", success_msg))
             else:
                 failed_msg = "\n".join(failed_recipients)
-                partial_msg = f"Successfully sent {success_count} out of {total_recipients} emails."
-                messagebox.showwarning("Partial Success", f"{partial_msg}\n\nFailed recipients:\n{failed_msg}")
-                self.log_and_display(f"{partial_msg} Failed recipients: {failed_msg}", 'warning')
-            
+                if campaign.failure_count > len(failed_recipients):
+                    failed_msg += f"\n... and {campaign.failure_count - len(failed_recipients):,} more (see the log file)"
+                partial_msg = f"{title}: successfully sent {success_count} out of {total_recipients} emails."
+                self.log_and_display(f"{partial_msg} {campaign.failure_count} recipients failed "
+                                     f"(kept in {DEFAULT_DEAD_LETTER_PATH} for replaying)", 'warning')
+                self.run_in_ui(lambda: messagebox.showwarning(
+                    "Partial Success", f"{partial_msg}\n\nFailed recipients:\n{failed_msg}"))
+
         except Exception as e:
             error_msg = f"An unexpected error occurred: {str(e)}"
-            messagebox.showerror("Error", error_msg)
             self.log_and_display(error_msg, 'error')
-        
+            self.run_in_ui(lambda: messagebox.showerror("Error", error_msg))
+
         finally:
-            # Re-enable input fields and send button, disable stop button
-            self.toggle_input_state("normal")
-            self.stop_button.config(state="disabled")
-            self.stop_flag = False
+            if journal is not None:
+                # Unfinished journals are offered for resume next time
+                journal.close(done=finished)
+
+            self.run_in_ui(self.update_campaign_list)
 
     def initialize_mailer(self):
         try:
@@ -490,6 +920,18 @@ class EmailSenderGUI:
             os.environ['SENDER_NAME'] = settings['sender_name']
             
             self.mailer = OneSignalMailer()
+
+            # Runs campaigns side by side on the account's send rate
+            self.manager = CampaignManager(self.mailer)
+
+            # Unsubscribed and bounced addresses are never mailed again
+            self.suppression = SuppressionList(DEFAULT_SUPPRESSION_PATH)
+
+            # Every recipient's outcome, queryable later with results.py
+            self.results = ResultsStore(DEFAULT_RESULTS_PATH)
+
+            # Failed recipients, for "Replay Failed" or deadletter.py
+            self.dead_letters = DeadLetterQueue(DEFAULT_DEAD_LETTER_PATH)
             return True
         except (FileNotFoundError, json.JSONDecodeError, ValueError) as e:
             messagebox.showerror("Configuration Error", str(e))
@@ -499,6 +941,20 @@ def main():
     root = ctk.CTk()
     app = EmailSenderGUI(root)
     root.mainloop()
+    if getattr(app, 'manager', None) is not None:
+        # Cancelled campaigns keep their journals, so they can be resumed
+        app.manager.cancel_all()
+        app.manager.wait(SHUTDOWN_TIMEOUT)
+    if getattr(app, 'mailer', None) is not None:
+        app.mailer.close()
+    if getattr(app, 'suppression', None) is not None:
+        app.suppression.close()
+    if getattr(app, 'results', None) is not None:
+        app.results.close()
+    if getattr(app, 'dead_letters', None) is not None:
+        app.dead_letters.close()
+    if getattr(app, 'log_listener', None) is not None:
+        app.stop_logging()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from validation import SeenSet
+
+# Record types
+START = 'start'
+ATTEMPT = 'attempt'
+SENT = 'sent'
+FAILED = 'failed'
+DONE = 'done'
+
+# How long records may wait before a group commit (seconds)
+DEFAULT_COMMIT_INTERVAL = 0.02
+
+JOURNAL_DIR = 'journals'
+
+
+def content_id(*parts):
+    """Stable id for campaign content, used to match a journal to its campaign"""
+    digest = hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+    return digest[:32]
+
+
+class JournalState:
+    """What an existing journal says about a campaign"""
+
+    def __init__(self):
+        self.campaign_id = None
+        self.content_id = None
+        self.done = False
+        # Fingerprints of recipients OneSignal accepted
+        self.sent = SeenSet()
+        self.notification_ids = {}
+        # Batches that were attempted with no recorded outcome: key -> recipients
+        self.in_doubt = {}
+        self.failed = {}
+        # Bytes of the file holding complete records
+        self.valid_length = 0
+
+    def apply(self, record):
+        kind = record.get('t')
+        if kind == START:
+            self.campaign_id = record['campaign']
+            self.content_id = record.get('content')
+        elif kind == ATTEMPT:
+            self.in_doubt[record['batch']] = record['recipients']
+        elif kind == SENT:
+            recipients = self.in_doubt.pop(record['batch'], [])
+            rejected = set(record.get('invalid', ()))
+            for recipient in recipients:
+                if recipient not in rejected:
+                    self.sent.add(recipient)
+                    self.failed.pop(recipient, None)
+            self.notification_ids[record['batch']] = record.get('id')
+        elif kind == FAILED:
+            for recipient in self.in_doubt.pop(record['batch'], []):
+                self.failed[recipient] = record.get('error')
+        elif kind == DONE:
+            self.done = True
+
+    def is_sent(self, recipient):
+        return recipient in self.sent
+
+    def in_doubt_batches(self):
+        """{recipient: batch key} for batches with no recorded outcome"""
+        return {recipient: key for key, recipients in self.in_doubt.items() for recipient in recipients}
+
+
+def load_journal(path):
+    """Replay a journal file into a JournalState; a torn final line is ignored"""
+    state = JournalState()
+    if not os.path.exists(path):
+        return state
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # partial write from a crash; nothing after it was committed
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            state.apply(record)
+            state.valid_length += len(line)
+    return state
+
+
+class CampaignJournal:
+    """Append-only, crash-safe record of a campaign's progress.
+
+    Each batch is logged as attempted before it is sent and as sent or failed
+    afterwards. Records are written by a background thread that fsyncs once
+    per group of records (every `commit_interval` seconds at most), so
+    concurrent workers share the cost of each fsync. Workers wait for their
+    attempt record to be durable before sending, which together with a
+    per-batch idempotency key means a resumed campaign never delivers a batch
+    twice.
+    """
+
+    def __init__(self, path, content='', resume=True, commit_interval=DEFAULT_COMMIT_INTERVAL):
+        self.path = path
+        self.commit_interval = commit_interval
+
+        state = load_journal(path) if resume else JournalState()
+        if state.done:
+            # Finished campaigns start over with a fresh journal
+            state = JournalState()
+        if state.campaign_id and state.content_id != content:
+            raise ValueError(f"Journal {path} belongs to a different campaign")
+        self.state = state
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fresh = state.campaign_id is None
+        self._file = open(path, 'wb' if fresh else 'ab')
+        if not fresh:
+            # Cut off a torn record so new ones start on a clean line
+            self._file.truncate(state.valid_length)
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._next_seq = 0
+        self._durable_seq = 0
+        self._closed = False
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, name='journal-writer', daemon=True)
+        self._writer.start()
+
+        if fresh:
+            state.campaign_id = str(uuid.uuid4())
+            state.content_id = content
+            self.wait_durable(self.append({'t': START, 'campaign': state.campaign_id,
+                                           'content': content, 'ts': time.time()}))
+
+    @property
+    def campaign_id(self):
+        return self.state.campaign_id
+
+    def batch_key(self, recipients):
+        """Deterministic idempotency key for a batch of this campaign"""
+        digest = hashlib.sha256('\n'.join(recipients).encode('utf-8')).hexdigest()
+        return str(uuid.uuid5(uuid.UUID(self.campaign_id), digest))
+
+    def append(self, record):
+        """Queue a record; returns a sequence number for wait_durable()"""
+        line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self._cond:
+            if self._closed:
+                raise ValueError("Journal is closed")
+            self._next_seq += 1
+            self._pending.append(line)
+            self._cond.notify_all()
+            return self._next_seq
+
+    def wait_durable(self, seq):
+        """Block until record `seq` has been fsynced"""
+        with self._cond:
+            while self._durable_seq < seq and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending and self._closed:
+                    return
+            # Let more records join this group before paying for the fsync
+            time.sleep(self.commit_interval)
+            with self._cond:
+                lines, self._pending = self._pending, []
+                seq = self._next_seq
+            try:
+                self._file.write(b''.join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._durable_seq = seq
+                self._cond.notify_all()
+
+    def record_attempt(self, key, recipients):
+        return self.append({'t': ATTEMPT, 'batch': key, 'recipients': list(recipients)})
+
+    def record_result(self, key, batch_result):
+        if batch_result.error is not None:
+            self.append({'t': FAILED, 'batch': key, 'error': str(batch_result.error)})
+        else:
+            self.append({'t': SENT, 'batch': key, 'id': batch_result.notification_id,
+                         'invalid': list(batch_result.failed)})
+
+    def close(self, done=False):
+        """Flush everything; `done=True` marks the campaign as finished"""
+        if done:
+            self.append({'t': DONE, 'ts': time.time()})
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,324 @@
+import itertools
+import threading
+import time
+import uuid
+from collections import deque
+
+from campaign import CampaignExecutor
+from rate_limiter import TokenBucket
+
+# Longest single wait while queued for the budget (seconds)
+POLL_INTERVAL = 0.2
+
+# Throughput is averaged over this many recent seconds
+THROUGHPUT_WINDOW = 10.0
+
+# Campaign states
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLING = 'cancelling'
+CANCELLED = 'cancelled'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+
+class FairShare:
+    """One account-wide send budget split between campaigns by weight.
+
+    `bucket` is a TokenBucket holding the global rate (recipients per
+    second), or None when sending is unlimited. Campaigns draw on it through
+    their own ShareClient. Waiting clients are served in start-time fair
+    queuing order: each grant advances a client's tag by cost / weight, so
+    a campaign of weight 4 gets four times the recipients of a weight 1
+    campaign while both are busy. A campaign that is idle or paused doesn't
+    bank credit, and its share goes to the others.
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self.bucket = TokenBucket(rate, burst=burst) if rate else None
+        self._condition = threading.Condition()
+        self._waiting = {}
+        self._virtual_time = 0.0
+
+    def set_rate(self, rate, burst=None):
+        """Change the global rate; 0 removes the limit"""
+        with self._condition:
+            if not rate:
+                self.bucket = None
+            elif self.bucket is None:
+                self.bucket = TokenBucket(rate, burst=burst)
+            else:
+                self.bucket.set_rate(rate, burst=burst)
+            self._condition.notify_all()
+
+    def client(self, weight=1, metered=True):
+        return ShareClient(self, weight, metered)
+
+    def _next(self):
+        """Waiting client with the lowest tag; ties go to the earliest arrival"""
+        return min(self._waiting, key=self._waiting.get)
+
+    def acquire(self, client, tokens, stop_event=None):
+        """Block until `client` may spend `tokens`; False if stopped first.
+
+        More than the bucket's burst is granted a burst at a time, queuing
+        again between pieces, so one large batch can't put the bucket deep
+        into debt and hold up every other campaign regardless of weight.
+        """
+        while tokens > 0:
+            bucket = self.bucket
+            piece = tokens if bucket is None else min(tokens, max(1, int(bucket.burst)))
+            if not self._acquire(client, piece, stop_event):
+                return False
+            tokens -= piece
+        return True
+
+    def _acquire(self, client, tokens, stop_event=None):
+        with self._condition:
+            while True:
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                if client.paused:
+                    # A paused campaign doesn't hold up anyone else
+                    self._condition.wait(POLL_INTERVAL)
+                    continue
+                bucket = self.bucket
+                if bucket is None or not client.metered:
+                    return True
+
+                if client not in self._waiting:
+                    # Time spent idle earns no credit
+                    client.tag = max(client.tag, self._virtual_time)
+                    self._waiting[client] = (client.tag, next(ShareClient.arrivals))
+                if self._next() is not client:
+                    self._condition.wait(POLL_INTERVAL)
+                    continue
+
+                delay = bucket.reserve(tokens)
+                if delay == 0.0:
+                    del self._waiting[client]
+                    self._virtual_time = client.tag
+                    client.tag += tokens / client.weight
+                    self._condition.notify_all()
+                    return True
+                self._condition.wait(min(delay, POLL_INTERVAL))
+
+    def release(self, client):
+        """Forget a client that stopped waiting, e.g. because it was cancelled"""
+        with self._condition:
+            if self._waiting.pop(client, None) is not None:
+                self._condition.notify_all()
+
+
+class ShareClient:
+    """One campaign's view of a FairShare, usable as its executor's rate limiter.
+
+    Unmetered clients (server-scheduled campaigns, which OneSignal paces)
+    skip the budget but can still be paused.
+    """
+
+    # Arrival order, to break ties between equal tags
+    arrivals = itertools.count()
+
+    def __init__(self, budget, weight=1, metered=True):
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        self.budget = budget
+        self.weight = weight
+        self.metered = metered
+        self.paused = False
+        self.tag = 0.0
+
+    @property
+    def bucket(self):
+        # The mailer retries against the same bucket, so the executor prepays it
+        return self.budget.bucket
+
+    def cost(self, recipient_count):
+        bucket = self.bucket
+        return bucket.cost(recipient_count) if bucket is not None else recipient_count
+
+    def acquire(self, tokens=1, stop_event=None):
+        try:
+            return self.budget.acquire(self, tokens, stop_event)
+        finally:
+            if stop_event is not None and stop_event.is_set():
+                self.budget.release(self)
+
+    def pause(self):
+        self.paused = True
+        self.budget.release(self)
+
+    def resume(self):
+        self.paused = False
+
+
+class ManagedCampaign:
+    """A campaign running under a CampaignManager, with live progress"""
+
+    def __init__(self, executor, client, subject, total=None):
+        self.executor = executor
+        self.client = client
+        self.subject = subject
+        self.total = total
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self._samples = deque()
+        self._done = threading.Event()
+        self.thread = None
+
+    @property
+    def name(self):
+        return self.executor.name
+
+    @property
+    def weight(self):
+        return self.client.weight
+
+    @property
+    def state(self):
+        if self.error is not None:
+            return FAILED
+        if self._done.is_set():
+            return CANCELLED if self.result.stopped else FINISHED
+        if self.executor.stopped:
+            return CANCELLING
+        return PAUSED if self.client.paused else RUNNING
+
+    @property
+    def active(self):
+        return not self._done.is_set()
+
+    @property
+    def attempted(self):
+        return self.progress.total if self.progress is not None else 0
+
+    @property
+    def sent(self):
+        return self.progress.success_count if self.progress is not None else 0
+
+    @property
+    def failed(self):
+        return self.progress.failure_count if self.progress is not None else 0
+
+    def _record(self, progress):
+        self.progress = progress
+        now = time.monotonic()
+        self._samples.append((now, progress.total))
+        while self._samples and now - self._samples[0][0] > THROUGHPUT_WINDOW:
+            self._samples.popleft()
+
+    def throughput(self):
+        """Recipients per second over the last THROUGHPUT_WINDOW seconds"""
+        now = time.monotonic()
+        samples = [sample for sample in list(self._samples) if now - sample[0] <= THROUGHPUT_WINDOW]
+        if not self.active or len(samples) < 2:
+            return 0.0
+        # Measured up to now, so a stalled or paused campaign drops towards zero
+        first_time, first_total = samples[0]
+        return (samples[-1][1] - first_total) / (now - first_time)
+
+    def pause(self):
+        """Stop starting requests; in-flight ones finish"""
+        self.client.pause()
+
+    def resume(self):
+        self.client.resume()
+
+    def cancel(self):
+        self.client.resume()
+        self.executor.stop()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+class CampaignManager:
+    """Runs several campaigns at once on one mailer and one send budget.
+
+    `rate` is the account-wide limit in recipients per second (0 for
+    none). Each campaign gets a share in proportion to its `weight`, so a
+    small urgent campaign can go out next to a long bulk one. The mailer's
+    rate limiter is set to the shared bucket, so retries and 429 backoff
+    slow every campaign down together.
+    """
+
+    def __init__(self, mailer, rate=0, burst=None):
+        self.mailer = mailer
+        self.budget = FairShare(rate, burst)
+        self.mailer.rate_limiter = self.budget.bucket
+        self._campaigns = []
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate, burst=None):
+        self.budget.set_rate(rate, burst)
+        self.mailer.rate_limiter = self.budget.bucket
+
+    def start(self, message, subject, recipients, weight=1, name=None, total=None, on_result=None,
+              on_finish=None, executor_class=CampaignExecutor, **options):
+        """Start a campaign on its own thread and return its ManagedCampaign.
+
+        `options` are passed to `executor_class` (workers, validator,
+        journal, planner and so on). `on_result` is called like the
+        executor's; `on_finish(campaign)` is called on the campaign's thread
+        once it has finished, been cancelled or failed.
+        """
+        journal = options.get('journal')
+        if name is None:
+            name = journal.campaign_id if journal is not None else f"campaign-{uuid.uuid4().hex[:12]}"
+        # OneSignal paces server-scheduled campaigns itself
+        client = self.budget.client(weight, metered=options.get('planner') is None)
+
+        def record(batch_result, progress):
+            campaign._record(progress)
+            if on_result is not None:
+                on_result(batch_result, progress)
+
+        executor = executor_class(self.mailer, rate_limiter=client, on_result=record, name=name, **options)
+        campaign = ManagedCampaign(executor, client, subject, total)
+
+        def run():
+            try:
+                campaign.result = executor.run(message, subject, recipients)
+            except Exception as e:
+                campaign.error = e
+            finally:
+                self.budget.release(client)
+                campaign.finished = time.time()
+                campaign._done.set()
+            if on_finish is not None:
+                on_finish(campaign)
+
+        campaign.thread = threading.Thread(target=run, name=f'campaign-{name}', daemon=True)
+        with self._lock:
+            self._campaigns.append(campaign)
+        campaign.thread.start()
+        return campaign
+
+    def campaigns(self):
+        """Every campaign started so far, oldest first"""
+        with self._lock:
+            return list(self._campaigns)
+
+    def active(self):
+        return [campaign for campaign in self.campaigns() if campaign.active]
+
+    def clear_finished(self):
+        with self._lock:
+            self._campaigns = [campaign for campaign in self._campaigns if campaign.active]
+
+    def cancel_all(self):
+        for campaign in self.active():
+            campaign.cancel()
+
+    def wait(self, timeout=None):
+        """Wait for every campaign to end; False if `timeout` ran out first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for campaign in self.campaigns():
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not campaign.wait(remaining):
+                return False
+        return True
@@ -0,0 +1,293 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from retry import error_status
+
+# Upper bounds of the request latency histogram buckets (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Campaign label used when no campaign is active
+DEFAULT_CAMPAIGN = 'default'
+
+# Status class for requests that got no HTTP response (timeouts, resets)
+NO_RESPONSE = 'error'
+
+METRIC_PREFIX = 'onesignal_mailer'
+
+# Campaign that requests on this thread or task are counted under
+_current_campaign = contextvars.ContextVar('campaign', default=DEFAULT_CAMPAIGN)
+
+
+@contextlib.contextmanager
+def campaign_label(name):
+    """Count requests made inside the block under campaign `name`"""
+    token = _current_campaign.set(str(name))
+    try:
+        yield
+    finally:
+        _current_campaign.reset(token)
+
+
+def status_class(status):
+    """'2xx', '4xx', ... for an HTTP status; NO_RESPONSE for None"""
+    if status is None:
+        return NO_RESPONSE
+    return f"{status // 100}xx"
+
+
+class _Series:
+    """Counters for one campaign, owned by a single thread"""
+
+    __slots__ = ('requests', 'statuses', 'buckets', 'latency_sum', 'bytes_sent', 'recipients', 'retries')
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        # One slot per bucket plus one for latencies above the last bound
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.bytes_sent = 0
+        self.recipients = 0
+        self.retries = 0
+
+    def add(self, other):
+        """Add another series' counts into this one"""
+        self.requests += other.requests
+        for key, count in other.statuses.items():
+            self.statuses[key] = self.statuses.get(key, 0) + count
+        for i, count in enumerate(other.buckets):
+            self.buckets[i] += count
+        self.latency_sum += other.latency_sum
+        self.bytes_sent += other.bytes_sent
+        self.recipients += other.recipients
+        self.retries += other.retries
+
+
+class _ShardOwner:
+    """Kept in a thread's local storage, so it is dropped when the thread exits"""
+
+    __slots__ = ('__weakref__',)
+
+
+def _retire_shard(metrics_ref, shard):
+    metrics = metrics_ref()
+    if metrics is not None:
+        metrics._retire(shard)
+
+
+class SendMetrics:
+    """Request instrumentation for the send path.
+
+    Every thread records into its own counters, so recording never takes a
+    lock and costs a few dict and list updates per request; `snapshot()`
+    adds the per-thread counters up. Counters are broken down by campaign:
+    use `campaign_label()` around the sends of a campaign. When a thread
+    exits, its counters are folded into a shared total, so a long-running
+    process that starts a worker pool per campaign doesn't keep a shard for
+    every thread it ever had.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Live threads' counters by id(shard), and those of exited threads
+        self._shards = {}
+        self._retired = {}
+        self._started = {}
+
+    def _series(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            owner = self._local.owner = _ShardOwner()
+            weakref.finalize(owner, _retire_shard, weakref.ref(self), shard)
+            with self._lock:
+                self._shards[id(shard)] = shard
+
+        campaign = _current_campaign.get()
+        series = shard.get(campaign)
+        if series is None:
+            series = shard[campaign] = _Series()
+            with self._lock:
+                self._started.setdefault(campaign, time.monotonic())
+        return series
+
+    def observe_request(self, latency, status, bytes_sent, recipients=0):
+        """Record one HTTP attempt; `recipients` counts only accepted ones"""
+        series = self._series()
+        series.requests += 1
+        key = status_class(status)
+        series.statuses[key] = series.statuses.get(key, 0) + 1
+        series.buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        series.latency_sum += latency
+        series.bytes_sent += bytes_sent
+        series.recipients += recipients
+
+    def observe_error(self, latency, error, bytes_sent):
+        self.observe_request(latency, error_status(error), bytes_sent)
+
+    def observe_retry(self):
+        self._series().retries += 1
+
+    def _retire(self, shard):
+        """Fold an exited thread's counters into the shared total"""
+        with self._lock:
+            del self._shards[id(shard)]
+            for campaign, series in shard.items():
+                retired = self._retired.get(campaign)
+                if retired is None:
+                    retired = self._retired[campaign] = _Series()
+                retired.add(series)
+
+    def snapshot(self):
+        """{campaign: totals} summed over all threads"""
+        totals = {}
+        with self._lock:
+            # Read with the shard list, so a thread retiring meanwhile isn't counted twice
+            for campaign, series in self._retired.items():
+                _add_totals(totals, campaign, series)
+            shards = list(self._shards.values())
+            started = dict(self._started)
+
+        now = time.monotonic()
+        for shard in shards:
+            for campaign, series in list(shard.items()):
+                _add_totals(totals, campaign, series)
+
+        for campaign, total in totals.items():
+            total['elapsed'] = now - started.get(campaign, now)
+            _derive(total)
+        return totals
+
+    def to_json(self):
+        return format_json(self.snapshot())
+
+    def to_prometheus(self):
+        """Snapshot in the Prometheus text exposition format"""
+        return format_prometheus(self.snapshot())
+
+    def write(self, path):
+        """Export to `path`: JSON for *.json, Prometheus text otherwise.
+
+        The file is replaced atomically, so a collector never reads half of it.
+        """
+        write_snapshot(self.snapshot(), path)
+
+
+def _empty_totals():
+    return {
+        'requests': 0, 'statuses': {}, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        'latency_sum': 0.0, 'bytes_sent': 0, 'recipients': 0, 'retries': 0, 'elapsed': 0.0,
+    }
+
+
+def _add_totals(totals, campaign, series):
+    total = totals.get(campaign)
+    if total is None:
+        total = totals[campaign] = _empty_totals()
+    total['requests'] += series.requests
+    for key, count in list(series.statuses.items()):
+        total['statuses'][key] = total['statuses'].get(key, 0) + count
+    for i, count in enumerate(series.buckets):
+        total['buckets'][i] += count
+    total['latency_sum'] += series.latency_sum
+    total['bytes_sent'] += series.bytes_sent
+    total['recipients'] += series.recipients
+    total['retries'] += series.retries
+
+
+def _derive(total):
+    """Fill in the rate and quantiles from the raw counters"""
+    elapsed = total['elapsed']
+    total['recipients_per_second'] = total['recipients'] / elapsed if elapsed > 0 else 0.0
+    total['p50'] = _quantile(total['buckets'], 0.5)
+    total['p99'] = _quantile(total['buckets'], 0.99)
+
+
+def _quantile(buckets, q):
+    """Upper bound of the histogram bucket holding quantile q"""
+    count = sum(buckets)
+    if not count:
+        return None
+    rank = q * count
+    seen = 0
+    for bound, bucket_count in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+        seen += bucket_count
+        if seen >= rank:
+            return bound
+    return float('inf')
+
+
+def merge_snapshots(snapshots):
+    """Add up snapshots taken in different processes running side by side"""
+    merged = {}
+    for snapshot in snapshots:
+        for campaign, total in snapshot.items():
+            into = merged.get(campaign)
+            if into is None:
+                into = merged[campaign] = _empty_totals()
+            for key in ('requests', 'latency_sum', 'bytes_sent', 'recipients', 'retries'):
+                into[key] += total[key]
+            for key, count in total['statuses'].items():
+                into['statuses'][key] = into['statuses'].get(key, 0) + count
+            for i, count in enumerate(total['buckets']):
+                into['buckets'][i] += count
+            into['elapsed'] = max(into['elapsed'], total['elapsed'])
+    for total in merged.values():
+        _derive(total)
+    return merged
+
+
+def format_json(snapshot):
+    snapshot = {campaign: dict(total) for campaign, total in snapshot.items()}
+    for total in snapshot.values():
+        total['buckets'] = dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], total['buckets']))
+        if total['p99'] == float('inf'):
+            total['p99'] = None
+    return json.dumps(snapshot, indent=2)
+
+
+def format_prometheus(snapshot):
+    """Snapshot in the Prometheus text exposition format"""
+    p = METRIC_PREFIX
+    lines = [
+        f"# TYPE {p}_requests_total counter",
+        f"# TYPE {p}_request_duration_seconds histogram",
+        f"# TYPE {p}_bytes_sent_total counter",
+        f"# TYPE {p}_recipients_sent_total counter",
+        f"# TYPE {p}_retries_total counter",
+    ]
+    for campaign, total in sorted(snapshot.items()):
+        label = f'campaign="{_escape(campaign)}"'
+        for key, count in sorted(total['statuses'].items()):
+            lines.append(f'{p}_requests_total{{{label},status_class="{key}"}} {count}')
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, total['buckets']):
+            cumulative += count
+            lines.append(f'{p}_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines.append(f'{p}_request_duration_seconds_bucket{{{label},le="+Inf"}} {total["requests"]}')
+        lines.append(f'{p}_request_duration_seconds_sum{{{label}}} {total["latency_sum"]}')
+        lines.append(f'{p}_request_duration_seconds_count{{{label}}} {total["requests"]}')
+        lines.append(f'{p}_bytes_sent_total{{{label}}} {total["bytes_sent"]}')
+        lines.append(f'{p}_recipients_sent_total{{{label}}} {total["recipients"]}')
+        lines.append(f'{p}_retries_total{{{label}}} {total["retries"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_snapshot(snapshot, path):
+    """Write a snapshot to `path` atomically: JSON for *.json, Prometheus text otherwise"""
+    text = format_json(snapshot) if path.endswith('.json') else format_prometheus(snapshot)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
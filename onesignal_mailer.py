@@ -1,21 +1,203 @@
+import hashlib
 import json
 import os
+import time
+import uuid
+from functools import cached_property
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # orjson is optional and only makes encoding faster
+    orjson = None
+
+from metrics import SendMetrics
+from retry import RetryPolicy, is_rate_limited
+from templates import CompiledTemplate
+
+ONESIGNAL_API_URL = 'https://onesignal.com/api/v1/notifications'
+
+# Connection pool and timeout defaults (seconds)
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+
+# Placeholders that are filled from campaign-wide values
+CAMPAIGN_FIELDS = {'message', 'subject', 'sender_name'}
+
+# The notifications endpoint accepts at most this many tokens per request
+MAX_BATCH_SIZE = 2000
+
+# Start of every request body; the recipient array follows
+PAYLOAD_PREFIX = b'{"include_email_tokens":'
+
+
+def load_env_file(path='.env'):
+    """Load settings from a .env file; python-dotenv is only imported when used"""
+    from dotenv import load_dotenv
+    return load_dotenv(path)
+
+
+def chunked(items, size):
+    """Yield lists of at most `size` items from any iterable"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def json_bytes(obj):
+    """Encode an object as compact UTF-8 JSON, using orjson when installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def invalid_tokens_from_errors(errors):
+    """Extract the rejected email tokens from a OneSignal `errors` field"""
+    if isinstance(errors, dict):
+        return set(errors.get('invalid_email_tokens') or [])
+    return set()
+
+
+class BatchResult:
+    """Outcome of a single batched send request"""
+
+    def __init__(self, recipients, response=None, error=None):
+        self.recipients = list(recipients)
+        self.response = response
+        self.error = error
+        # Seconds the request took, retries included, when known
+        self.latency = None
+        # Addresses OneSignal rejected as undeliverable
+        self.invalid = []
+
+        if error is not None:
+            # The whole request failed, so nobody in the chunk was mailed
+            self.sent = []
+            self.failed = {recipient: str(error) for recipient in self.recipients}
+        else:
+            errors = (response or {}).get('errors')
+            if isinstance(errors, list) and errors and not (response or {}).get('id'):
+                # Accepted by the API but nobody was targeted, e.g. all unsubscribed
+                self.sent = []
+                self.failed = {recipient: '; '.join(map(str, errors)) for recipient in self.recipients}
+            else:
+                invalid = invalid_tokens_from_errors(errors)
+                self.sent = [r for r in self.recipients if r not in invalid]
+                self.failed = {r: 'Invalid email token' for r in self.recipients if r in invalid}
+                self.invalid = [r for r in self.recipients if r in invalid]
+
+    @property
+    def notification_id(self):
+        return (self.response or {}).get('id')
+
+    @property
+    def ok(self):
+        return self.error is None and not self.failed
+
+def new_idempotency_key():
+    """Fresh key for one request; every retry of that request reuses it"""
+    return str(uuid.uuid4())
+
+
+def with_idempotency_key(payload):
+    """`payload`, copied with a fresh idempotency key unless it already has one"""
+    if payload.get('idempotency_key') is not None:
+        return payload
+    return {'idempotency_key': new_idempotency_key(), **payload}
+
+
+class PreparedSend:
+    """A campaign payload serialized once, with recipients spliced in per request.
+
+    Everything except `include_email_tokens` is identical for every request
+    of a campaign, so it is encoded to bytes up front and each request only
+    encodes its own token array.
+    """
+
+    def __init__(self, mailer, message, subject, merge_values=None, template=None, sender_name=None):
+        self.mailer = mailer
+        payload = mailer.build_payload(message, subject, [], merge_values, template, sender_name)
+        del payload['include_email_tokens']
+        constant = json_bytes(payload)
+
+        # '{"include_email_tokens":' + tokens + ',' + rest of the object
+        self.prefix = PAYLOAD_PREFIX
+        self.suffix = b',' + constant[1:] if len(constant) > 2 else b'}'
+
+    @classmethod
+    def from_suffix(cls, mailer, suffix):
+        """PreparedSend for a payload kept from an earlier `suffix`, e.g. to replay failures"""
+        prepared = cls.__new__(cls)
+        prepared.mailer = mailer
+        prepared.prefix = PAYLOAD_PREFIX
+        prepared.suffix = suffix
+        return prepared
+
+    @cached_property
+    def payload_id(self):
+        """Stable id of everything in the payload except its recipients"""
+        return hashlib.blake2b(self.suffix, digest_size=16).hexdigest()
+
+    def body(self, recipients, idempotency_key=None, send_after=None):
+        """Full JSON request body for a list of recipients"""
+        if idempotency_key is None and send_after is None:
+            return b''.join((self.prefix, json_bytes(list(recipients)), self.suffix))
+        head = [b'{']
+        if idempotency_key is not None:
+            # OneSignal drops repeats of a request carrying the same idempotency_key
+            head += [b'"idempotency_key":', json_bytes(idempotency_key), b',']
+        if send_after is not None:
+            # Delivered by OneSignal at this time rather than straight away
+            head += [b'"send_after":', json_bytes(send_after), b',']
+        return b''.join(head + [self.prefix[1:], json_bytes(list(recipients)), self.suffix])
+
+    def send_chunk(self, chunk, prepaid=False, idempotency_key=None, send_after=None):
+        """Send one request to a chunk of recipients, capturing any error.
+
+        Without an `idempotency_key` the request gets a fresh one, so a retry
+        after a timeout or 5xx that actually went through isn't delivered twice.
+        """
+        started = time.perf_counter()
+        if idempotency_key is None:
+            idempotency_key = new_idempotency_key()
+        try:
+            body = self.body(chunk, idempotency_key, send_after)
+            response = self.mailer.post_body(body, len(chunk), prepaid=prepaid)
+        except Exception as e:
+            batch_result = BatchResult(chunk, error=e)
+        else:
+            batch_result = BatchResult(chunk, response=response)
+        batch_result.latency = time.perf_counter() - started
+        return batch_result
+
 
 class OneSignalMailer:
-    def __init__(self):
-        # Load environment variables
-        # load_dotenv()
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, rate_limiter=None, retry_policy=None,
+                 metrics=None, api_url=None, minify_body=True):
+        # Environment variables are loaded by the caller (see load_env_file)
         
         # Initialize configuration
         self.one_signal_app_id = os.getenv('ONESIGNAL_APP_ID')
         self.one_signal_api_key = os.getenv('ONESIGNAL_API_KEY')
         self.email_from = os.getenv('EMAIL_FROM')
         self.sender_name = os.getenv('SENDER_NAME')
+
+        # Overridable so tests and benchmarks can point at a local server
+        self.api_url = api_url or os.getenv('ONESIGNAL_API_URL') or ONESIGNAL_API_URL
+
+        # Templates are sent with indentation and comments stripped
+        self.minify_body = minify_body
         
         # Default email template
-        self.email_template = '''
+        self.set_email_template('''
         <!DOCTYPE html>
         <html>
         <head>
@@ -43,73 +225,227 @@ class OneSignalMailer:
             </table>
         </body>
         </html>
-        '''
+        ''')
         
         if not all([self.one_signal_app_id, self.one_signal_api_key, 
                    self.email_from, self.sender_name]):
             raise ValueError("Missing required environment variables. Please check .env file.")
 
-    def set_email_template(self, template):
-        """Update the email template"""
+        # Request headers are the same for every send
+        self.headers = {
+            'Content-Type': 'application/json;charset=utf-8',
+            'Authorization': f'Basic {self.one_signal_api_key}',
+        }
+        self.timeout = (connect_timeout, read_timeout)
+
+        # Optional TokenBucket shared with other mailers/executors
+        self.rate_limiter = rate_limiter
+
+        # Transient failures (429/5xx, connection errors) are retried with backoff
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+        # Latency, status and throughput counters; cheap enough to leave on
+        self.metrics = metrics if metrics is not None else SendMetrics()
+
+        # Long-lived session so connections (and TLS handshakes) are reused
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def set_email_template(self, template, merge_fields=None):
+        """Update the email template.
+
+        The template is compiled once here. Placeholders other than
+        CAMPAIGN_FIELDS are merge fields filled from recipient data; pass
+        `merge_fields` to restrict them, in which case unknown placeholders
+        raise KeyError. Malformed braces raise ValueError.
+
+        With `minify_body` the HTML is minified once here, and
+        `body_bytes_saved` tells how much smaller each request gets.
+        """
+        allowed_fields = None
+        if merge_fields is not None:
+            allowed_fields = CAMPAIGN_FIELDS | set(merge_fields)
+        compiled = CompiledTemplate(template, allowed_fields=allowed_fields)
+
+        self.body_bytes_saved = 0
+        if self.minify_body:
+            minified = compiled.minified()
+            self.body_bytes_saved = len(json_bytes(compiled.literal_text())) - len(json_bytes(minified.literal_text()))
+            compiled = minified
+
+        self.compiled_template = compiled
         self.email_template = template
 
     def get_email_template(self):
         """Get the current email template"""
         return self.email_template
 
-    def send_mail(self, message, subject, recipient_email):
-        # Format the HTML message using the template
-        html_message = self.email_template.format(
-            message=message,
-            subject=subject,
-            sender_name=self.sender_name
-        )
+    def template_fields(self):
+        """Return the set of placeholder names used by the current template"""
+        return self.compiled_template.fields
+
+    def merge_fields(self, template=None):
+        """Placeholders that are filled per recipient, e.g. {name}"""
+        template = self.compiled_template if template is None else template
+        return template.fields - CAMPAIGN_FIELDS
+
+    def is_personalized(self, template=None):
+        """True when the template renders differently per recipient"""
+        return bool(self.merge_fields(template))
+
+    def build_payload(self, message, subject, recipient_emails, merge_values=None, template=None,
+                      sender_name=None):
+        """Build the notification payload for one or more recipients.
+
+        `merge_values` supplies the merge fields shared by all of them.
+        `template` and `sender_name` default to the mailer's current ones; a
+        campaign passes the ones it started with, so editing the template
+        mid-campaign doesn't change the emails it has yet to send.
+        """
+        template = self.compiled_template if template is None else template
+        sender_name = self.sender_name if sender_name is None else sender_name
+        if merge_values:
+            # Per-recipient values would only churn the render cache
+            html_message = template.render_uncached(
+                **merge_values,
+                message=message,
+                subject=subject,
+                sender_name=sender_name
+            )
+        else:
+            # Render the HTML message; repeated inputs come from the render cache
+            html_message = template.render(
+                message=message,
+                subject=subject,
+                sender_name=sender_name
+            )
 
         # Construct the request payload with improved parameters
-        payload = {
+        return {
             'app_id': self.one_signal_app_id,
             'contents': {'en': message},  # Plain text version
             'headings': {'en': subject},
-            'email_from_name': self.sender_name,
+            'email_from_name': sender_name,
             'email_from_address': self.email_from,
             'email_reply_to_address': self.email_from,
             'email_subject': subject,
-            'include_email_tokens': [recipient_email],
+            'include_email_tokens': list(recipient_emails),
             'email_body': html_message,  # HTML version
             'email_click_tracking': True,  # Enable click tracking
             'email_open_tracking': True,   # Enable open tracking
             'email_format': 'multipart/alternative',  # Send both HTML and plain text
         }
 
-        # Set up request headers
-        headers = {
-            'Content-Type': 'application/json;charset=utf-8',
-            'Authorization': f'Basic {self.one_signal_api_key}',
-        }
+    def prepare(self, message, subject, merge_values=None, template=None, sender_name=None):
+        """Render and serialize a campaign once for many sends"""
+        if merge_values is None and self.is_personalized(template):
+            fields = ', '.join(sorted(self.merge_fields(template)))
+            raise ValueError(f"Template has merge fields ({fields}); send it with CampaignExecutor "
+                             "so each recipient gets their own values")
+        return PreparedSend(self, message, subject, merge_values, template, sender_name)
 
-        # Send the POST request
-        response = requests.post(
-            'https://onesignal.com/api/v1/notifications',
-            data=json.dumps(payload),
-            headers=headers
-        )
+    def post_payload(self, payload, prepaid=False):
+        """POST a notification payload and return the decoded response.
 
-        # Raise an exception for bad responses
-        response.raise_for_status()
-        
-        return response.json()
+        The payload gets an idempotency key if it has none, so retries can't
+        deliver twice.
+        """
+        payload = with_idempotency_key(payload)
+        return self.post_body(json_bytes(payload), len(payload['include_email_tokens']), prepaid=prepaid)
+
+    def post_body(self, body, recipient_count, prepaid=False):
+        """POST an encoded JSON body and return the decoded response.
+
+        Retryable failures are retried according to `retry_policy`; the body
+        should carry an idempotency_key, or a retried timeout may deliver
+        twice (post_payload and PreparedSend add one). Pass
+        `prepaid=True` when the caller already took rate limiter tokens for
+        the first attempt.
+        """
+        # Read once, so swapping the limiter mid-request is safe
+        rate_limiter = self.rate_limiter
+        cost = None
+        if rate_limiter is not None:
+            cost = rate_limiter.cost(recipient_count)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            if cost is not None and (attempt > 1 or not prepaid):
+                rate_limiter.acquire(cost)
+
+            started = time.perf_counter()
+            try:
+                # Send the POST request over the pooled session
+                response = self.session.post(
+                    self.api_url,
+                    data=body,
+                    timeout=self.timeout
+                )
+
+                # Raise an exception for bad responses
+                response.raise_for_status()
+            except Exception as e:
+                self.metrics.observe_error(time.perf_counter() - started, e, len(body))
+                if not self.retry_policy.should_retry(e, attempt):
+                    raise
+                self.metrics.observe_retry()
+                delay = self.retry_policy.delay(attempt, e)
+                if rate_limiter is not None and is_rate_limited(e):
+                    # Slow everyone sharing the bucket down, not just this request
+                    rate_limiter.throttle(pause=delay)
+                time.sleep(delay)
+                continue
+
+            self.metrics.observe_request(time.perf_counter() - started, response.status_code, len(body),
+                                         recipient_count)
+            if rate_limiter is not None:
+                rate_limiter.recover()
+            return response.json()
+
+    def send_mail(self, message, subject, recipient_email, merge_values=None):
+        payload = self.build_payload(message, subject, [recipient_email], merge_values)
+        return self.post_payload(payload)
+
+    def send_batch(self, message, subject, recipients, batch_size=MAX_BATCH_SIZE):
+        """Send the same email to many recipients, one request per chunk.
+
+        Returns a list with one BatchResult per chunk, in order.
+        """
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}")
+
+        prepared = self.prepare(message, subject)
+        return [prepared.send_chunk(chunk) for chunk in chunked(recipients, batch_size)]
+
+    def send_chunk(self, message, subject, chunk, prepaid=False):
+        """Send one request to a chunk of recipients, capturing any error"""
+        return self.prepare(message, subject).send_chunk(chunk, prepaid=prepaid)
 
 def main():
     # Example usage
     try:
-        mailer = OneSignalMailer()
-        
-        # Send a test email
-        response = mailer.send_mail(
-            message="Hello! This is a test email sent via OneSignal API.",
-            subject="Test Email",
-            recipient_email="recipient@example.com"
-        )
+        load_env_file()
+        with OneSignalMailer() as mailer:
+            # Send a test email
+            response = mailer.send_mail(
+                message="Hello! This is a test email sent via OneSignal API.",
+                subject="Test Email",
+                recipient_email="recipient@example.com"
+            )
         
         print("Email sent successfully!")
         print("Response:", json.dumps(response, indent=2))
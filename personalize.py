@@ -0,0 +1,120 @@
+import itertools
+from collections import OrderedDict
+from functools import lru_cache
+
+from onesignal_mailer import BatchResult, MAX_BATCH_SIZE
+from recipients import recipient_email
+
+# Distinct merge-value combinations buffered before the oldest is flushed
+DEFAULT_MAX_OPEN_GROUPS = 1000
+
+
+class FailedRender:
+    """Stands in for a PreparedSend when a recipient's email can't be rendered"""
+
+    def __init__(self, error):
+        self.error = error
+
+    def send_chunk(self, chunk, prepaid=False, idempotency_key=None, send_after=None):
+        return BatchResult(chunk, error=self.error)
+
+
+class PersonalizedCampaign:
+    """Turns a stream of recipient rows into (prepared send, addresses) work items.
+
+    Recipients whose merge values are identical get identical emails, so
+    they are grouped into one batched request. Only a bounded number of
+    groups is buffered: a group is flushed when it reaches `batch_size`, and
+    the oldest open group is flushed when there are more than
+    `max_open_groups`. Memory use therefore doesn't grow with the input.
+
+    Emails are rendered as groups fill up, so the mailer's template and
+    sender name are captured here: a template saved mid-campaign only
+    applies to later campaigns.
+    """
+
+    def __init__(self, mailer, message, subject, batch_size=MAX_BATCH_SIZE,
+                 max_open_groups=DEFAULT_MAX_OPEN_GROUPS, template=None, sender_name=None):
+        self.mailer = mailer
+        self.message = message
+        self.subject = subject
+        self.batch_size = batch_size
+        self.max_open_groups = max_open_groups
+        self.template = mailer.compiled_template if template is None else template
+        self.sender_name = mailer.sender_name if sender_name is None else sender_name
+        self.fields = tuple(sorted(mailer.merge_fields(self.template)))
+
+        # Groups that fill up more than once reuse their serialized payload
+        self._prepare = lru_cache(maxsize=max_open_groups)(self._prepare_uncached)
+
+    def _prepare_uncached(self, key):
+        return self.mailer.prepare(self.message, self.subject, dict(zip(self.fields, key)), self.template,
+                                   self.sender_name)
+
+    def merge_key(self, recipient):
+        """Tuple of this recipient's merge values, in field order"""
+        if isinstance(recipient, str):
+            recipient = {'email': recipient}
+        try:
+            return tuple(recipient[field] for field in self.fields)
+        except KeyError as e:
+            raise ValueError(f"Missing merge field {e}") from None
+
+    def missing_fields(self, recipient):
+        """Merge fields a recipient row has no column for"""
+        if isinstance(recipient, str):
+            return list(self.fields)
+        return [field for field in self.fields if field not in recipient]
+
+    def prepared_for(self, recipient):
+        """Prepared send for a single recipient's merge values"""
+        try:
+            return self._prepare(self.merge_key(recipient))
+        except Exception as e:
+            return FailedRender(e)
+
+    def _flush(self, key, emails):
+        try:
+            return self._prepare(key), emails
+        except Exception as e:
+            return FailedRender(e), emails
+
+    def work_items(self, recipients):
+        """Yield (prepared, emails) pairs ready for `prepared.send_chunk(emails)`.
+
+        Raises ValueError before yielding anything if the first recipient has
+        no column for one of the merge fields: that is almost always a typo
+        in the template, e.g. {mesage}, and every recipient would fail.
+        """
+        recipients = iter(recipients)
+        first = next(recipients, None)
+        if first is not None:
+            missing = self.missing_fields(first)
+            if missing:
+                placeholders = ', '.join(f"{{{field}}}" for field in missing)
+                raise ValueError(f"Template placeholder(s) {placeholders} match no recipient column; "
+                                 "fix the template or add the column(s)")
+            recipients = itertools.chain([first], recipients)
+        groups = OrderedDict()
+
+        for recipient in recipients:
+            email = recipient_email(recipient)
+            try:
+                key = self.merge_key(recipient)
+            except ValueError as e:
+                yield FailedRender(e), [email]
+                continue
+
+            emails = groups.get(key)
+            if emails is None:
+                emails = groups[key] = []
+            emails.append(email)
+
+            if len(emails) >= self.batch_size:
+                del groups[key]
+                yield self._flush(key, emails)
+            elif len(groups) > self.max_open_groups:
+                yield self._flush(*groups.popitem(last=False))
+
+        for key, emails in groups.items():
+            yield self._flush(key, emails)
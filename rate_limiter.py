@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+
+# Rate limiter units
+PER_REQUEST = 'request'
+PER_RECIPIENT = 'recipient'
+
+# Repeated rate-limit signals within this window only cut the rate once
+THROTTLE_COOLDOWN = 1.0
+
+# Longest single sleep while waiting on a stop event (seconds)
+POLL_INTERVAL = 0.2
+
+
+def _validate(rate, burst):
+    if rate <= 0:
+        raise ValueError("rate must be positive")
+    if burst < 1:
+        raise ValueError("burst must be at least 1")
+    return float(rate), float(burst)
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by mailers and executors.
+
+    `rate` tokens are added per second up to `burst`. Depending on `per`, a
+    request costs one token or one token per recipient. A cost larger than
+    the burst is allowed once the bucket is full and leaves it in debt, so
+    large batches still respect the long-run rate.
+    """
+
+    def __init__(self, rate, burst=None, per=PER_RECIPIENT):
+        if per not in (PER_REQUEST, PER_RECIPIENT):
+            raise ValueError(f"per must be '{PER_REQUEST}' or '{PER_RECIPIENT}'")
+        self.per = per
+        self.rate, self.burst = _validate(rate, burst if burst is not None else max(1, rate))
+        # Configured rate that adaptive backoff recovers towards
+        self.target_rate = self.rate
+        self._throttled_at = None
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate, burst=None):
+        """Change the refill rate, e.g. to back off after rate-limit responses"""
+        with self._lock:
+            self._refill()
+            self.rate, self.burst = _validate(rate, burst if burst is not None else self.burst)
+            self.target_rate = self.rate
+            self._tokens = min(self._tokens, self.burst)
+
+    def throttle(self, pause=0.0, factor=0.5, min_fraction=0.05):
+        """React to a rate-limit response shared by every user of the bucket.
+
+        Cuts the rate by `factor` (never below `min_fraction` of the
+        configured rate) and, if `pause` is given, holds back all tokens for
+        that many seconds so no worker sends until the server is ready.
+        """
+        with self._lock:
+            self._refill()
+            now = time.monotonic()
+            if self._throttled_at is None or now - self._throttled_at >= THROTTLE_COOLDOWN:
+                # Workers hitting the same limit together should only cut the rate once
+                self.rate = max(self.target_rate * min_fraction, self.rate * factor)
+                self._throttled_at = now
+            if pause > 0:
+                self._tokens = min(self._tokens, -pause * self.rate)
+
+    def recover(self, fraction=0.05):
+        """Step the rate back up towards the configured rate after a success"""
+        if self.rate >= self.target_rate:
+            return
+        with self._lock:
+            self._refill()
+            self.rate = min(self.target_rate, self.rate + self.target_rate * fraction)
+
+    def cost(self, recipient_count):
+        """Tokens needed for one request to `recipient_count` recipients"""
+        return 1 if self.per == PER_REQUEST else recipient_count
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens=1):
+        """Take tokens and return 0.0 if available; otherwise return how long to wait.
+
+        A request for more than `burst` tokens is admitted once the bucket is
+        full and leaves it in debt by the difference, which later requests
+        wait out. `burst` therefore doesn't cap a single request; callers
+        that want bounded bursts should keep each request within it, as
+        CampaignExecutor does.
+        """
+        with self._lock:
+            self._refill()
+            needed = min(tokens, self.burst)
+            if self._tokens >= needed:
+                self._tokens -= tokens
+                return 0.0
+            return (needed - self._tokens) / self.rate
+
+    def try_acquire(self, tokens=1):
+        return self.reserve(tokens) == 0.0
+
+    def acquire(self, tokens=1, stop_event=None):
+        """Block until `tokens` are available.
+
+        Returns False without taking tokens if `stop_event` is set first.
+        """
+        while True:
+            delay = self.reserve(tokens)
+            if delay == 0.0:
+                return True
+            if stop_event is None:
+                time.sleep(delay)
+            elif stop_event.wait(min(delay, POLL_INTERVAL)):
+                return False
+
+    async def acquire_async(self, tokens=1):
+        """Wait for `tokens` without blocking the event loop"""
+        while True:
+            delay = self.reserve(tokens)
+            if delay == 0.0:
+                return True
+            await asyncio.sleep(delay)
@@ -0,0 +1,135 @@
+import codecs
+import csv
+import io
+import itertools
+import mmap
+import os
+
+# Files at least this large are read through mmap instead of buffered reads
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+# Block size for counting lines without loading the file
+COUNT_BLOCK_SIZE = 1024 * 1024
+
+# Header names recognised as the address column in recipient data files
+EMAIL_COLUMNS = ('email', 'email_address', 'e-mail', 'mail')
+
+
+def recipient_email(recipient):
+    """Address of a recipient given as a plain string or a data row"""
+    if isinstance(recipient, str):
+        return recipient
+    return recipient['email']
+
+
+def merge_field_name(header):
+    """'First Name' -> 'first_name', so headers can be used as placeholders"""
+    return '_'.join(header.strip().lower().replace('-', ' ').split())
+
+
+def find_email_column(fieldnames):
+    for name in fieldnames or ():
+        if name.strip().lower() in EMAIL_COLUMNS:
+            return name
+    return None
+
+
+def iter_csv_rows(lines):
+    """Yield recipient rows (dicts with an 'email' key) from CSV lines.
+
+    The first line is the header. Other columns become merge fields named
+    after their header, e.g. a `Name` column fills {name} and `First Name`
+    fills {first_name}.
+    """
+    reader = csv.DictReader(lines)
+    email_column = find_email_column(reader.fieldnames)
+    if email_column is None:
+        raise ValueError("Recipient data needs an 'email' column")
+
+    for row in reader:
+        email = (row.pop(email_column, None) or '').strip()
+        if not email:
+            continue
+        values = {merge_field_name(key): (value or '').strip() for key, value in row.items() if key}
+        values['email'] = email
+        yield values
+
+
+def read_recipient_rows(path, encoding='utf-8-sig'):
+    """Stream recipient rows from a CSV data file"""
+    with open(path, newline='', encoding=encoding) as f:
+        yield from iter_csv_rows(f)
+
+
+def looks_like_csv_header(line):
+    return ',' in line and find_email_column(next(csv.reader([line]), [])) is not None
+
+
+def parse_recipient_text(text):
+    """Parse pasted recipients: one address per line, or CSV with a header row"""
+    lines = text.splitlines()
+    first = next((line for line in lines if line.strip()), '')
+    if looks_like_csv_header(first):
+        return list(iter_csv_rows(io.StringIO(text)))
+    return [line.strip() for line in lines if line.strip()]
+
+
+class RecipientFile:
+    """Streams recipients from a CSV data file or a one-address-per-line file.
+
+    The file is never loaded whole: iteration reads it line by line (through
+    mmap for files of MMAP_THRESHOLD bytes or more), so memory use is
+    constant however many recipients it holds. CSV is detected from a header
+    row with an email column; anything else is treated as plain addresses.
+    """
+
+    def __init__(self, path, encoding='utf-8-sig'):
+        self.path = path
+        self.encoding = encoding
+        self.size = os.path.getsize(path)
+        with open(path, encoding=encoding, errors='replace') as f:
+            first = next((line for line in f if line.strip()), '')
+        self.is_csv = looks_like_csv_header(first)
+
+    def _lines(self, f):
+        """Decoded text lines from an open binary file"""
+        if self.size >= MMAP_THRESHOLD:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield from codecs.iterdecode(iter(mapped.readline, b''), self.encoding)
+            finally:
+                mapped.close()
+        else:
+            yield from codecs.iterdecode(f, self.encoding)
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            lines = self._lines(f)
+            if self.is_csv:
+                yield from iter_csv_rows(lines)
+            else:
+                for line in lines:
+                    email = line.strip()
+                    if email:
+                        yield email
+
+    def line_count(self):
+        """Number of lines in the file, counted in fixed-size blocks"""
+        count = 0
+        last = b'\n'
+        with open(self.path, 'rb') as f:
+            for block in iter(lambda: f.read(COUNT_BLOCK_SIZE), b''):
+                count += block.count(b'\n')
+                last = block[-1:]
+        if last != b'\n':
+            count += 1  # final line without a trailing newline
+        return count
+
+    def estimated_count(self):
+        """Recipient count from the line count (blank lines are included)"""
+        lines = self.line_count()
+        return max(0, lines - 1) if self.is_csv else lines
+
+    def preview(self, limit=10):
+        """The first `limit` recipients"""
+        return list(itertools.islice(self, limit))
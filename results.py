@@ -0,0 +1,251 @@
+"""Local store of per-recipient delivery results.
+
+Query it from the command line:
+    python results.py campaigns
+    python results.py failures <campaign id>
+    python results.py recipient someone@example.com
+"""
+import argparse
+import contextlib
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+DEFAULT_RESULTS_PATH = 'results.db'
+
+# Delivery statuses
+SENT = 'sent'
+FAILED = 'failed'
+INVALID = 'invalid'
+
+# Most rows written in one transaction
+WRITE_BATCH_ROWS = 10000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS campaigns (
+    id TEXT PRIMARY KEY,
+    subject TEXT,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY,
+    campaign TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    notification_id TEXT,
+    status TEXT NOT NULL,
+    latency REAL,
+    error TEXT,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deliveries_campaign ON deliveries (campaign, status);
+CREATE INDEX IF NOT EXISTS deliveries_recipient ON deliveries (recipient);
+CREATE INDEX IF NOT EXISTS deliveries_status ON deliveries (status, ts);
+'''
+
+DELIVERY_COLUMNS = ('campaign', 'recipient', 'notification_id', 'status', 'latency', 'error', 'ts')
+INSERT_DELIVERIES = (f"INSERT INTO deliveries ({', '.join(DELIVERY_COLUMNS)}) "
+                     f"VALUES ({', '.join('?' * len(DELIVERY_COLUMNS))})")
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+def delivery_rows(campaign, batch_result, ts=None):
+    """deliveries rows for one BatchResult"""
+    ts = time.time() if ts is None else ts
+    notification_id = batch_result.notification_id
+    latency = batch_result.latency
+    invalid = set(batch_result.invalid)
+    rows = [(campaign, recipient, notification_id, SENT, latency, None, ts) for recipient in batch_result.sent]
+    for recipient, error in batch_result.failed.items():
+        status = INVALID if recipient in invalid else FAILED
+        rows.append((campaign, recipient, notification_id, status, latency, error, ts))
+    return rows
+
+
+class ResultsStore:
+    """SQLite record of what happened to every recipient of every campaign.
+
+    `record()` only queues the batch result, so senders never wait on the
+    database; a writer thread turns queued results into rows and inserts
+    them in batched transactions. The file uses WAL mode, so queries (and
+    other processes, such as sharded workers) can read while a campaign is
+    writing.
+    """
+
+    def __init__(self, path=DEFAULT_RESULTS_PATH):
+        self.path = path
+        with contextlib.closing(_connect(path)) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+
+        self._queue = queue.SimpleQueue()
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, name='results-writer', daemon=True)
+        self._writer.start()
+
+    def start_campaign(self, campaign, subject=None):
+        self._queue.put(('campaign', (campaign, subject, time.time())))
+
+    def finish_campaign(self, campaign):
+        self._queue.put(('finished', (time.time(), campaign)))
+
+    def record(self, campaign, batch_result):
+        """Queue a BatchResult for writing; returns immediately"""
+        self._queue.put(('batch', (campaign, batch_result, time.time())))
+
+    def flush(self):
+        """Block until everything recorded so far is written"""
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        done.wait()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self._queue.put(('close', None))
+        self._writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_loop(self):
+        connection = _connect(self.path)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        closing = False
+        while not closing:
+            items = [self._queue.get()]
+            # Take whatever else is already waiting, up to one transaction's worth
+            rows = 0
+            while rows < WRITE_BATCH_ROWS:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                items.append(item)
+                if item[0] == 'batch':
+                    rows += len(item[1][1].recipients)
+
+            deliveries, flushes = [], []
+            try:
+                with connection:
+                    for kind, value in items:
+                        if kind == 'batch':
+                            campaign, batch_result, ts = value
+                            deliveries.extend(delivery_rows(campaign, batch_result, ts))
+                        elif kind == 'campaign':
+                            connection.execute(
+                                'INSERT OR IGNORE INTO campaigns (id, subject, started) VALUES (?, ?, ?)', value)
+                        elif kind == 'finished':
+                            # Rows queued before the finish belong before it
+                            connection.executemany(INSERT_DELIVERIES, deliveries)
+                            deliveries = []
+                            connection.execute('UPDATE campaigns SET finished = ? WHERE id = ?', value)
+                        elif kind == 'flush':
+                            flushes.append(value)
+                        elif kind == 'close':
+                            closing = True
+                    connection.executemany(INSERT_DELIVERIES, deliveries)
+            except sqlite3.Error as e:
+                self._error = e
+            for done in flushes:
+                done.set()
+        connection.close()
+
+    def campaigns(self):
+        """Every campaign with its per-status recipient counts, newest first"""
+        with contextlib.closing(_connect(self.path)) as connection:
+            campaigns = [dict(row) for row in connection.execute(
+                'SELECT id, subject, started, finished FROM campaigns ORDER BY started DESC')]
+            for campaign in campaigns:
+                campaign['counts'] = self.summary(campaign['id'], connection)
+        return campaigns
+
+    def summary(self, campaign, connection=None):
+        """{status: recipient count} for a campaign"""
+        own = connection is None
+        connection = connection or _connect(self.path)
+        try:
+            return {row['status']: row['count'] for row in connection.execute(
+                'SELECT status, COUNT(*) AS count FROM deliveries WHERE campaign = ? GROUP BY status', (campaign,))}
+        finally:
+            if own:
+                connection.close()
+
+    def deliveries(self, campaign=None, recipient=None, status=None, since=None, until=None, limit=None):
+        """Matching delivery rows as dicts, oldest first.
+
+        `status` is a status or a list of them; `since` and `until` are Unix
+        timestamps.
+        """
+        conditions, params = [], []
+        if campaign is not None:
+            conditions.append('campaign = ?')
+            params.append(campaign)
+        if recipient is not None:
+            conditions.append('recipient = ?')
+            params.append(recipient)
+        if status is not None:
+            statuses = [status] if isinstance(status, str) else list(status)
+            conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if since is not None:
+            conditions.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('ts < ?')
+            params.append(until)
+
+        sql = f"SELECT {', '.join(DELIVERY_COLUMNS)} FROM deliveries"
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with contextlib.closing(_connect(self.path)) as connection:
+            return [dict(row) for row in connection.execute(sql, params)]
+
+    def failures(self, campaign=None, since=None, until=None, limit=None):
+        """Recipients that were not delivered, with the reason"""
+        return self.deliveries(campaign=campaign, status=(FAILED, INVALID), since=since, until=until, limit=limit)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query stored delivery results.")
+    parser.add_argument('--db', default=DEFAULT_RESULTS_PATH, help=f"results database (default: {DEFAULT_RESULTS_PATH})")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('campaigns', help="list campaigns with their counts")
+    failures = commands.add_parser('failures', help="failed recipients of a campaign")
+    failures.add_argument('campaign')
+    recipient = commands.add_parser('recipient', help="every delivery to one address")
+    recipient.add_argument('address')
+    args = parser.parse_args(argv)
+
+    store = ResultsStore(args.db)
+    try:
+        if args.command == 'campaigns':
+            rows = store.campaigns()
+        elif args.command == 'failures':
+            rows = store.failures(args.campaign)
+        else:
+            rows = store.deliveries(recipient=args.address)
+    finally:
+        store.close()
+    for row in rows:
+        print(json.dumps(row))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
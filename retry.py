@@ -0,0 +1,97 @@
+import random
+import sys
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+# Responses worth retrying: rate limited or a transient server problem
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RATE_LIMITED_STATUS = 429
+
+# Transport errors worth retrying
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)
+
+
+def transient_errors():
+    """TRANSIENT_ERRORS plus aiohttp's, if the asyncio client has imported it"""
+    # Looked up rather than imported so the blocking client never pays for aiohttp
+    aiohttp = sys.modules.get('aiohttp')
+    if aiohttp is None:
+        return TRANSIENT_ERRORS
+    return TRANSIENT_ERRORS + (aiohttp.ClientConnectionError, aiohttp.ServerTimeoutError)
+
+
+def error_status(error):
+    """HTTP status code carried by an exception, if any"""
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        # aiohttp.ClientResponseError keeps the status on the exception itself
+        status = getattr(error, 'status', None)
+    return status
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def error_retry_after(error):
+    """Retry-After seconds from the response attached to an exception"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers is None:
+        headers = getattr(error, 'headers', None)
+    if not headers:
+        return None
+    return parse_retry_after(headers.get('Retry-After'))
+
+
+def is_rate_limited(error):
+    return error_status(error) == RATE_LIMITED_STATUS
+
+
+class RetryPolicy:
+    """Decides whether a failed request is retried and how long to wait.
+
+    Connection errors, timeouts and RETRYABLE_STATUS responses are retried
+    up to `max_attempts` times in total. Any other error is permanent.
+    Delays grow exponentially from `base_delay` up to `max_delay` with full
+    jitter, and never undercut a server-supplied Retry-After.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=60.0, jitter=True):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def is_retryable(self, error):
+        status = error_status(error)
+        if status is not None:
+            return status in RETRYABLE_STATUS
+        return isinstance(error, transient_errors())
+
+    def should_retry(self, error, attempt):
+        return attempt < self.max_attempts and self.is_retryable(error)
+
+    def delay(self, attempt, error=None):
+        """Seconds to wait before the next attempt (`attempt` is 1-based)"""
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter:
+            backoff = random.uniform(0, backoff)
+        retry_after = error_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return max(retry_after, backoff)
+        return backoff
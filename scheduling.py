@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta, timezone
+
+# Length of a delivery slot (seconds); each batch is scheduled at the start of one
+DEFAULT_SLOT_SECONDS = 300
+
+# Head start before the first slot so the whole campaign can be submitted (seconds)
+DEFAULT_LEAD_TIME = 60
+
+# send_after format OneSignal accepts, always in UTC
+SEND_AFTER_FORMAT = '%Y-%m-%d %H:%M:%S GMT+0000'
+
+
+def format_send_after(moment):
+    """OneSignal send_after string for an aware datetime"""
+    return moment.astimezone(timezone.utc).strftime(SEND_AFTER_FORMAT)
+
+
+class SlotPlanner:
+    """Spreads a campaign over time slots so at most `per_hour` recipients are delivered per hour.
+
+    Time is cut into slots of `slot_seconds` starting at `start` (default:
+    `lead_time` seconds from now). Each slot holds its share of the hourly
+    rate, with fractions carried over so the long-run rate is exact.
+    `plan(chunk)` splits a batch to fit the slots and pairs each piece with
+    its `send_after` time, so the whole campaign can be handed to OneSignal
+    at once and the server does the spacing.
+    """
+
+    def __init__(self, per_hour, start=None, slot_seconds=DEFAULT_SLOT_SECONDS, lead_time=DEFAULT_LEAD_TIME):
+        if per_hour <= 0:
+            raise ValueError("per_hour must be positive")
+        if slot_seconds <= 0:
+            raise ValueError("slot_seconds must be positive")
+        if start is None:
+            start = datetime.now(timezone.utc) + timedelta(seconds=lead_time)
+        elif start.tzinfo is None:
+            raise ValueError("start must be a timezone-aware datetime")
+
+        self.per_hour = per_hour
+        self.slot_seconds = slot_seconds
+        self.start = start
+        self._slot = 0
+        self._used = 0
+        self.planned = 0
+
+    def _allowance(self, slot):
+        """Recipients allowed in slots 0..slot-1 together"""
+        return int(slot * self.slot_seconds * self.per_hour / 3600)
+
+    def capacity(self, slot):
+        return self._allowance(slot + 1) - self._allowance(slot)
+
+    def slot_time(self, slot):
+        return self.start + timedelta(seconds=slot * self.slot_seconds)
+
+    @property
+    def end(self):
+        """Start of the last slot used so far"""
+        return self.slot_time(self._slot)
+
+    def plan(self, chunk, split=True):
+        """Yield (send_after, piece) pairs covering `chunk`.
+
+        With `split=False` the chunk is kept whole in the next slot with any
+        room, e.g. to resend a journaled batch under its original
+        idempotency key; the following slots absorb the overflow.
+        """
+        chunk = list(chunk)
+        while chunk:
+            room = self.capacity(self._slot) - self._used
+            if room <= 0:
+                # Overflow from an unsplit batch is paid back by later slots
+                self._used = -room
+                self._slot += 1
+                continue
+            piece = chunk if not split else chunk[:room]
+            chunk = chunk[len(piece):]
+            self._used += len(piece)
+            self.planned += len(piece)
+            yield format_send_after(self.slot_time(self._slot)), piece
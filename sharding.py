@@ -0,0 +1,371 @@
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from campaign import CampaignExecutor, CampaignResult, DEFAULT_WORKERS
+from domains import DEFAULT_DOMAIN_BUFFER
+from metrics import DEFAULT_CAMPAIGN, merge_snapshots
+from onesignal_mailer import MAX_BATCH_SIZE
+from recipients import RecipientFile, recipient_email
+from scheduling import DEFAULT_LEAD_TIME, SlotPlanner
+from validation import SeenSet, ValidationReport, normalize_email
+
+# Seconds between progress messages from each shard
+PROGRESS_INTERVAL = 1.0
+
+# How often the coordinator checks on its worker processes (seconds)
+POLL_INTERVAL = 0.2
+
+
+def shard_of(address, shard_count):
+    """Shard index for an address; the same on every run and every machine"""
+    return SeenSet.fingerprint(normalize_email(address) or address) % shard_count
+
+
+def shard_journal_path(path, index, shard_count):
+    """Journal file for one shard, next to `path`"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{index}-of-{shard_count}{ext}"
+
+
+class ShardedResult(CampaignResult):
+    """CampaignResult merged from every shard that ran"""
+
+    def __init__(self):
+        super().__init__()
+        self.completed_shards = []
+        # Shards that crashed or raised: index -> error text; rerun them with run(shards=...)
+        self.failed_shards = {}
+        self.metrics = {}
+
+    def add_shard(self, index, shard):
+        self.completed_shards.append(index)
+        self.total += shard['total']
+        self.success_count += shard['success_count']
+        self.failed.update(shard['failed'])
+        self.suppressed += shard['suppressed']
+        self.already_sent += shard['already_sent']
+        if shard['valid'] is not None:
+            if self.validation is None:
+                self.validation = ValidationReport()
+            self.validation.valid += shard['valid']
+            for reason, count in shard['rejected'].items():
+                self.validation.rejected[reason] = self.validation.rejected.get(reason, 0) + count
+        self.metrics = merge_snapshots([self.metrics, shard['metrics']])
+
+
+def run_shard(index, shard_count, source, message, subject, config, events, stop_event):
+    """Send one shard of a campaign; the body of each worker process"""
+    # Ctrl+C reaches the whole process group; the coordinator stops us through stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        shard = _run_shard(index, shard_count, source, message, subject, config, events, stop_event)
+    except BaseException as e:
+        events.put(('error', index, f"{type(e).__name__}: {e}"))
+    else:
+        events.put(('done', index, shard))
+
+
+def _run_shard(index, shard_count, source, message, subject, config, events, stop_event):
+    # Heavy imports happen in the worker, not in every process that imports this module
+    from journal import CampaignJournal
+    from onesignal_mailer import OneSignalMailer
+    from rate_limiter import TokenBucket
+
+    os.environ.update(config['settings'])
+    mailer = OneSignalMailer(pool_size=config['workers'], api_url=config['api_url'],
+                             minify_body=config['minify_body'])
+    if config['template'] is not None:
+        mailer.set_email_template(config['template'])
+    planner = None
+    if config['schedule'] and config['rate']:
+        # Every shard fills its share of the same delivery slots
+        planner = SlotPlanner(config['rate'] * 3600 / shard_count, start=config['schedule_start'])
+    elif config['rate']:
+        # Shards running side by side split the campaign's rate equally
+        share = config['concurrent_shards']
+        burst = config['burst'] / share if config['burst'] else None
+        mailer.rate_limiter = TokenBucket(config['rate'] / share, burst=burst)
+
+    if isinstance(source, str):
+        # Every worker reads the file and keeps only its own shard
+        recipients = (recipient for recipient in RecipientFile(source)
+                      if shard_of(recipient_email(recipient), shard_count) == index)
+    else:
+        recipients = source
+
+    suppressed = [0]
+    suppression = None
+    if config['suppression_path']:
+        from suppression import SuppressionList
+
+        def count_suppressed(address):
+            suppressed[0] += 1
+
+        # Read-only here; the coordinator adds newly invalid addresses once all shards finish
+        suppression = SuppressionList(config['suppression_path'])
+        recipients = suppression.filter(recipients, on_suppressed=count_suppressed)
+
+    domain_scheduler = None
+    if config['interleave_domains'] or config['domain_rates'] or config['default_domain_rate']:
+        from domains import DomainScheduler
+        # A domain's addresses are spread over every shard, so its cap is shared like the rate
+        share = config['concurrent_shards']
+        domain_scheduler = DomainScheduler(
+            config['domain_buffer'],
+            domain_rates={domain: rate / share for domain, rate in config['domain_rates'].items()},
+            default_rate=config['default_domain_rate'] / share if config['default_domain_rate'] else None,
+        )
+
+    validator = None
+    if config['validate']:
+        from validation import RecipientValidator
+        validator = RecipientValidator()
+
+    results = None
+    if config['results_path']:
+        from results import ResultsStore
+        results = ResultsStore(config['results_path'])
+
+    dead_letters = None
+    if config['dead_letters_path']:
+        from deadletter import DeadLetterQueue
+        dead_letters = DeadLetterQueue(config['dead_letters_path'])
+
+    journal = None
+    if config['journal_path']:
+        journal = CampaignJournal(shard_journal_path(config['journal_path'], index, shard_count),
+                                  content=config['content'], resume=config['resume'])
+
+    invalid = []
+    last_report = [0.0]
+
+    def on_result(batch_result, progress):
+        invalid.extend(batch_result.invalid)
+        now = time.monotonic()
+        if now - last_report[0] >= PROGRESS_INTERVAL:
+            last_report[0] = now
+            events.put(('progress', index, (progress.total, progress.success_count, progress.failure_count)))
+
+    campaign = None
+    try:
+        executor = CampaignExecutor(
+            mailer,
+            workers=config['workers'],
+            batch_size=config['batch_size'],
+            validator=validator,
+            journal=journal,
+            on_result=on_result,
+            stop_event=stop_event,
+            name=config['name'],
+            planner=planner,
+            results=results,
+            domain_scheduler=domain_scheduler,
+            dead_letters=dead_letters,
+        )
+        campaign = executor.run(message, subject, recipients)
+    finally:
+        if results is not None:
+            results.close()
+        if dead_letters is not None:
+            dead_letters.close()
+        if journal is not None:
+            journal.close(done=campaign is not None and not campaign.stopped)
+        if suppression is not None:
+            suppression.close()
+        mailer.close()
+
+    return {
+        'total': campaign.total,
+        'success_count': campaign.success_count,
+        'failed': campaign.failed,
+        'stopped': campaign.stopped,
+        'suppressed': suppressed[0],
+        'already_sent': campaign.already_sent,
+        'valid': campaign.validation.valid if campaign.validation is not None else None,
+        'rejected': campaign.validation.rejected if campaign.validation is not None else {},
+        'invalid': invalid,
+        'metrics': mailer.metrics.snapshot(),
+    }
+
+
+class ShardedCampaign:
+    """Send a campaign from several processes, one shard of recipients each.
+
+    Recipients are assigned to `shard_count` shards by a hash of their
+    normalized address, so the layout is the same on every run and a shard
+    that failed can be rerun on its own with `run(..., shards=[index])`.
+    Up to `processes` shards run at once, each in its own process with its
+    own mailer, connection pool, CampaignExecutor (`workers` threads) and an
+    equal share of `rate` (recipients per second for the whole campaign). Because an address always lands in the same
+    shard, per-shard de-duplication is global.
+
+    Pass a file path (or RecipientFile) for very large lists: every worker
+    streams the file and keeps its own shard. Other iterables are
+    partitioned here and handed to the workers in memory.
+
+    With `journal_path`, each shard keeps its own journal next to it
+    (see shard_journal_path). With `results_path`, every shard writes its
+    outcomes to the same ResultsStore database, and with `dead_letters_path`
+    their failures to the same DeadLetterQueue. With `interleave_domains`
+    (implied by `domain_rates` or `default_domain_rate`) each shard runs its
+    recipients through a DomainScheduler whose caps are split between the
+    shards running at once. With `schedule=True` the rate is enforced by
+    OneSignal through send_after slots (see SlotPlanner) instead of by
+    waiting. `on_progress(attempted, sent, failed)` is called on the
+    calling thread as shards report in.
+    """
+
+    def __init__(self, mailer, shard_count=None, processes=None, workers=DEFAULT_WORKERS,
+                 batch_size=MAX_BATCH_SIZE, rate=0, burst=None, validate=True, suppression_path=None,
+                 journal_path=None, resume=True, content='', name=DEFAULT_CAMPAIGN, schedule=False,
+                 schedule_start=None, results_path=None, dead_letters_path=None, interleave_domains=False,
+                 domain_buffer=DEFAULT_DOMAIN_BUFFER, domain_rates=None, default_domain_rate=None,
+                 on_progress=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.shard_count = shard_count or self.processes
+        if self.shard_count < 1 or self.processes < 1:
+            raise ValueError("shard_count and processes must be at least 1")
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}")
+
+        self.mailer = mailer
+        self.suppression_path = suppression_path
+        self.on_progress = on_progress
+        self.config = {
+            'settings': {
+                'ONESIGNAL_APP_ID': mailer.one_signal_app_id,
+                'ONESIGNAL_API_KEY': mailer.one_signal_api_key,
+                'EMAIL_FROM': mailer.email_from,
+                'SENDER_NAME': mailer.sender_name,
+            },
+            'api_url': mailer.api_url,
+            'template': mailer.get_email_template(),
+            'minify_body': mailer.minify_body,
+            'workers': workers,
+            'batch_size': batch_size,
+            'rate': rate,
+            'burst': burst,
+            'validate': validate,
+            'suppression_path': suppression_path,
+            'journal_path': journal_path,
+            'resume': resume,
+            'content': content,
+            'name': name,
+            'schedule': schedule,
+            'schedule_start': schedule_start,
+            'results_path': results_path,
+            'dead_letters_path': dead_letters_path,
+            'interleave_domains': interleave_domains,
+            'domain_buffer': domain_buffer,
+            'domain_rates': dict(domain_rates or {}),
+            'default_domain_rate': default_domain_rate,
+        }
+
+        # Spawned workers start clean instead of inheriting this process's threads
+        self._context = multiprocessing.get_context('spawn')
+        self.stop_event = self._context.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def partition(self, recipients):
+        """Split an in-memory recipient list into per-shard lists"""
+        shards = [[] for _ in range(self.shard_count)]
+        for recipient in recipients:
+            shards[shard_of(recipient_email(recipient), self.shard_count)].append(recipient)
+        return shards
+
+    def run(self, message, subject, recipients, shards=None):
+        """Send the campaign (or only the listed shard indices) and return a ShardedResult"""
+        shards = list(range(self.shard_count)) if shards is None else list(shards)
+        for index in shards:
+            if not 0 <= index < self.shard_count:
+                raise ValueError(f"Shard {index} is out of range for {self.shard_count} shards")
+
+        if isinstance(recipients, RecipientFile):
+            recipients = recipients.path
+        if isinstance(recipients, str):
+            sources = dict.fromkeys(shards, recipients)
+        else:
+            partitioned = self.partition(recipients)
+            sources = {index: partitioned[index] for index in shards}
+
+        config = dict(self.config, concurrent_shards=max(min(self.processes, len(shards)), 1))
+        if config['schedule'] and config['schedule_start'] is None:
+            # All shards share one set of slots
+            config['schedule_start'] = datetime.now(timezone.utc) + timedelta(seconds=DEFAULT_LEAD_TIME)
+        result = ShardedResult()
+        events = self._context.Queue()
+        pending = deque(shards)
+        running = {}
+        progress = {}
+
+        def handle(event):
+            kind, index = event[0], event[1]
+            if kind == 'progress':
+                progress[index] = event[2]
+                if self.on_progress is not None:
+                    self.on_progress(*(sum(values) for values in zip(*progress.values())))
+                return
+            process = running.pop(index, None)
+            if process is not None:
+                process.join()
+            if kind == 'done':
+                shard = event[2]
+                progress[index] = (shard['total'], shard['success_count'], len(shard['failed']))
+                result.add_shard(index, shard)
+                if shard['invalid'] and self.suppression_path:
+                    self._suppress(shard['invalid'])
+            else:
+                result.failed_shards[index] = event[2]
+
+        def drain():
+            while True:
+                try:
+                    handle(events.get_nowait())
+                except queue.Empty:
+                    return
+
+        while pending or running:
+            while pending and len(running) < self.processes and not self.stopped:
+                index = pending.popleft()
+                process = self._context.Process(
+                    target=run_shard,
+                    args=(index, self.shard_count, sources.pop(index), message, subject, config, events,
+                          self.stop_event),
+                    name=f'campaign-shard-{index}',
+                )
+                process.start()
+                running[index] = process
+            if self.stopped:
+                pending.clear()
+
+            try:
+                handle(events.get(timeout=POLL_INTERVAL))
+            except queue.Empty:
+                pass
+
+            for index, process in list(running.items()):
+                if not process.is_alive():
+                    # Its last message, if any, is already in the queue
+                    drain()
+                    if index in running:
+                        running.pop(index).join()
+                        result.failed_shards[index] = f"worker exited with code {process.exitcode}"
+
+        result.stopped = self.stopped
+        return result
+
+    def _suppress(self, addresses):
+        from suppression import SuppressionList
+        with SuppressionList(self.suppression_path) as suppression:
+            suppression.add_many(addresses)
@@ -0,0 +1,174 @@
+import heapq
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_left
+
+from onesignal_mailer import chunked
+from recipients import recipient_email
+from validation import SeenSet, normalize_email
+
+# Index file header; entries follow as native-endian uint64 fingerprints
+MAGIC = b'OSSUPP1\n'
+
+# Appended entries are merged into the sorted index once the log is this long
+COMPACT_THRESHOLD = 1_000_000
+
+# Recipients screened per lock acquisition in filter()
+FILTER_BLOCK_SIZE = 4096
+
+DEFAULT_SUPPRESSION_PATH = 'suppression.idx'
+
+
+def fingerprint(address):
+    """Suppression key for an address; equal for every spelling normalize_email merges"""
+    return SeenSet.fingerprint(normalize_email(address) or address)
+
+
+class SuppressionList:
+    """On-disk list of addresses that must never be mailed again.
+
+    The index is a sorted array of 64-bit address fingerprints that is
+    memory-mapped, so opening it is instant whatever its size and lookups
+    are a binary search (O(log n)) without loading it. New entries go to an
+    append-only `.log` file next to it and an in-memory set; when the log
+    grows past COMPACT_THRESHOLD it is merged into a new index in one
+    streaming pass.
+    """
+
+    def __init__(self, path=DEFAULT_SUPPRESSION_PATH):
+        self.path = path
+        self.log_path = path + '.log'
+        self._lock = threading.Lock()
+        self._file = None
+        self._mmap = None
+        self._index = ()
+        self._open_index()
+
+        # Entries added since the last compaction
+        self._recent = set()
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'rb') as f:
+                data = f.read()
+            entries = array('Q')
+            entries.frombytes(data[:len(data) - len(data) % entries.itemsize])
+            self._recent.update(entries)
+        self._log = open(self.log_path, 'ab')
+
+    def _open_index(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= len(MAGIC):
+            return
+        self._file = open(self.path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._close_index()
+            raise ValueError(f"{self.path} is not a suppression index")
+        self._index = memoryview(self._mmap)[len(MAGIC):].cast('Q')
+
+    def _close_index(self):
+        if isinstance(self._index, memoryview):
+            self._index.release()
+        self._index = ()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close_index()
+            self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        """Number of entries (appended duplicates of indexed ones count twice until compaction)"""
+        return len(self._index) + len(self._recent)
+
+    def _contains_fingerprint(self, value):
+        if value in self._recent:
+            return True
+        index = self._index
+        position = bisect_left(index, value)
+        return position < len(index) and index[position] == value
+
+    def __contains__(self, address):
+        value = fingerprint(address)
+        with self._lock:
+            return self._contains_fingerprint(value)
+
+    def add(self, address):
+        self.add_many([address])
+
+    def add_many(self, addresses):
+        """Suppress addresses; written to the log immediately, no index rewrite"""
+        new = array('Q', (fingerprint(address) for address in addresses))
+        with self._lock:
+            new = array('Q', (value for value in new if not self._contains_fingerprint(value)))
+            if not new:
+                return 0
+            self._log.write(new.tobytes())
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._recent.update(new)
+            if len(self._recent) >= COMPACT_THRESHOLD:
+                self._compact()
+        return len(new)
+
+    def compact(self):
+        """Merge the append log into the sorted index"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        tmp_path = self.path + '.tmp'
+        previous = None
+        with open(tmp_path, 'wb') as out:
+            out.write(MAGIC)
+            buffer = array('Q')
+            for value in heapq.merge(self._index, sorted(self._recent)):
+                if value == previous:
+                    continue
+                previous = value
+                buffer.append(value)
+                if len(buffer) >= 65536:
+                    out.write(buffer.tobytes())
+                    buffer = array('Q')
+            out.write(buffer.tobytes())
+            out.flush()
+            os.fsync(out.fileno())
+
+        self._close_index()
+        os.replace(tmp_path, self.path)
+        self._open_index()
+
+        # The log's contents are now in the index
+        self._log.close()
+        self._log = open(self.log_path, 'wb')
+        self._recent = set()
+
+    def filter(self, recipients, on_suppressed=None, normalized=False):
+        """Yield recipients (addresses or data rows) that are not suppressed.
+
+        Recipients are screened in blocks: fingerprints are computed outside
+        the lock and looked up together, so a concurrent compaction can't
+        swap the index out mid-block. Pass `normalized=True` when addresses
+        already went through normalize_email, e.g. after RecipientValidator.
+        """
+        key = SeenSet.fingerprint if normalized else fingerprint
+        for block in chunked(recipients, FILTER_BLOCK_SIZE):
+            values = [key(recipient_email(recipient)) for recipient in block]
+            with self._lock:
+                suppressed = [self._contains_fingerprint(value) for value in values]
+            for recipient, is_suppressed in zip(block, suppressed):
+                if not is_suppressed:
+                    yield recipient
+                elif on_suppressed is not None:
+                    on_suppressed(recipient_email(recipient))
@@ -0,0 +1,205 @@
+import copy
+import re
+import string
+from functools import lru_cache
+
+# Rendered bodies kept per template; campaigns reuse one entry per message
+DEFAULT_RENDER_CACHE_SIZE = 128
+
+_formatter = string.Formatter()
+
+# Stands in for placeholders while the literal HTML around them is minified
+_PLACEHOLDER = '\x00'
+
+# Elements whose contents are whitespace-sensitive or not HTML
+_PRESERVED = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.S | re.I)
+
+# Whole comment tokens; '<!-->' is an empty comment on its own, as in
+# the '<!--[if !mso]><!-->...<!--<![endif]-->' pattern
+_COMMENT = re.compile(r'<!--(?:>|(.*?)-->)', re.S)
+
+# Comment contents that Outlook and other email clients act on
+_CONDITIONAL = re.compile(r'\s*(?:\[if\b|\[endif\]|<!\[endif\])', re.I)
+
+# Tags that never render the whitespace next to them
+_BLOCK_TAG = re.compile(
+    r'\s*(<(?:!doctype|/?(?:html|head|body|meta|link|title|table|thead|tbody|tfoot|tr|td|th|div|p|h[1-6]'
+    r'|ul|ol|li|br|hr|center|style)\b)[^>]*>)\s*',
+    re.I,
+)
+
+_STYLE_ATTRIBUTE = re.compile(r'(\sstyle=)(["\'])(.*?)\2', re.S | re.I)
+
+
+def _minify_style(declarations):
+    """'margin: 0; padding: 0; margin: 0;' -> 'padding:0;margin:0'"""
+    if 'url(' in declarations or '"' in declarations or "'" in declarations:
+        # Semicolons may be part of a value; only trim the ends
+        return declarations.strip()
+    parsed = []
+    values = {}
+    for declaration in declarations.split(';'):
+        name, colon, value = declaration.partition(':')
+        name = name.strip().lower()
+        if not colon or not name:
+            continue
+        value = value.strip()
+        parsed.append((name, value))
+        values.setdefault(name, set()).add(value)
+
+    kept = []
+    for i, (name, value) in enumerate(parsed):
+        # Only an exact repeat is redundant: differing values may be a
+        # fallback pair (display:block; display:flex) or !important
+        if len(values[name]) == 1 and (name, value) in parsed[i + 1:]:
+            continue
+        kept.append(f"{name}:{value}")
+    return ';'.join(kept)
+
+
+def _minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    return re.sub(r'\s*([{};])\s*', r'\1', css).strip()
+
+
+def _minify_comment(match):
+    content = match.group(1)
+    if content is None or _CONDITIONAL.match(content) or _PLACEHOLDER in content:
+        return match.group(0)
+    return ''
+
+
+def _minify_markup(html):
+    html = _COMMENT.sub(_minify_comment, html)
+    html = re.sub(r'\s+', ' ', html)
+    html = _BLOCK_TAG.sub(r'\1', html)
+    return _STYLE_ATTRIBUTE.sub(
+        lambda match: f"{match.group(1)}{match.group(2)}{_minify_style(match.group(3))}{match.group(2)}", html)
+
+
+def minify_html(html):
+    """Strip what a mail client never renders: comments, indentation and
+    redundant inline style declarations.
+
+    Whitespace runs become a single space and disappear entirely next to
+    block-level tags; <pre>, <textarea> and <script> are left alone and
+    <style> blocks only lose CSS comments and spacing. Conditional comments
+    are kept whole, including the downlevel-revealed form:
+
+    >>> minify_html('<div><!--[if !mso]><!--> <p>Web</p> <!--<![endif]--> <!-- note --></div>')
+    '<div><!--[if !mso]><!--><p>Web</p><!--<![endif]--></div>'
+    >>> minify_html('<div> <!--[if mso]><table><tr><td>Outlook</td></tr></table><![endif]--> </div>')
+    '<div><!--[if mso]><table><tr><td>Outlook</td></tr></table><![endif]--></div>'
+    """
+    parts = []
+    for i, part in enumerate(_PRESERVED.split(html)):
+        # split() yields text, whole preserved element, its tag name, text, ...
+        kind = i % 3
+        if kind == 0:
+            parts.append(_minify_markup(part))
+        elif kind == 1:
+            if part[1:6].lower() == 'style':
+                head, _, rest = part.partition('>')
+                body, _, tail = rest.rpartition('</')
+                part = f"{head}>{_minify_css(body)}</{tail}"
+            parts.append(part)
+    return ''.join(parts).strip()
+
+
+def base_field_name(field_name):
+    """'user.name' or 'items[0]' -> the top-level argument name"""
+    return field_name.split('.', 1)[0].split('[', 1)[0]
+
+
+class CompiledTemplate:
+    """A str.format style template parsed once into literal and field segments.
+
+    Rendering produces the same output as `source.format(**values)` but skips
+    re-parsing the template. Placeholders are checked against
+    `allowed_fields` at compile time, raising KeyError for unknown names just
+    like str.format would when sending.
+    """
+
+    def __init__(self, source, allowed_fields=None, cache_size=DEFAULT_RENDER_CACHE_SIZE):
+        self.source = source
+        self.cache_size = cache_size
+        self.segments = []
+        self.fields = set()
+
+        for literal, field_name, format_spec, conversion in _formatter.parse(source):
+            if literal:
+                self.segments.append(literal)
+            if field_name is None:
+                continue
+            if field_name == '' or field_name.isdigit():
+                raise ValueError("Positional placeholders are not supported, use named fields like {message}")
+            if '{' in (format_spec or ''):
+                raise ValueError(f"Nested placeholders are not supported in {{{field_name}}}")
+
+            name = base_field_name(field_name)
+            if not name.isidentifier():
+                raise ValueError(f"Invalid placeholder name: {{{field_name}}}")
+            if allowed_fields is not None and name not in allowed_fields:
+                raise KeyError(name)
+            self.fields.add(name)
+
+            if field_name == name and not format_spec and not conversion:
+                # Fast path: plain {name}
+                self.segments.append((name,))
+            else:
+                self.segments.append((field_name, format_spec, conversion))
+
+        # Memoized renderer; identical inputs return the cached string
+        self.render = lru_cache(maxsize=cache_size)(self.render_uncached)
+
+    def literal_text(self):
+        """The template's fixed text, without its placeholders"""
+        return ''.join(segment for segment in self.segments if segment.__class__ is str)
+
+    def minified(self):
+        """Copy of this template with minify_html applied to its fixed text.
+
+        Placeholders are left exactly where they were, so rendering the copy
+        gives the same email with fewer bytes.
+        """
+        literals, fields = [''], []
+        for segment in self.segments:
+            if segment.__class__ is str:
+                literals[-1] += segment
+            else:
+                fields.append(segment)
+                literals.append('')
+
+        minified = minify_html(_PLACEHOLDER.join(literals)).split(_PLACEHOLDER)
+        if len(minified) != len(literals):
+            # A placeholder vanished (e.g. inside a comment); keep the template as it is
+            return self
+
+        segments = [minified[0]] if minified[0] else []
+        for field, literal in zip(fields, minified[1:]):
+            segments.append(field)
+            if literal:
+                segments.append(literal)
+
+        template = copy.copy(self)
+        template.segments = segments
+        template.render = lru_cache(maxsize=self.cache_size)(template.render_uncached)
+        return template
+
+    def render_uncached(self, **values):
+        parts = []
+        for segment in self.segments:
+            if segment.__class__ is str:
+                parts.append(segment)
+            elif len(segment) == 1:
+                parts.append(str(values[segment[0]]))
+            else:
+                field_name, format_spec, conversion = segment
+                value, _ = _formatter.get_field(field_name, (), values)
+                value = _formatter.convert_field(value, conversion)
+                parts.append(format(value, format_spec))
+        return ''.join(parts)
+
+    def cache_info(self):
+        return self.render.cache_info()
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import BENCHMARK_SETTINGS, FakeOneSignalServer  # noqa: E402
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Local stand-in for the OneSignal API, with the settings a mailer needs"""
+    for name, value in BENCHMARK_SETTINGS.items():
+        monkeypatch.setenv(name, value)
+    with FakeOneSignalServer(latency=0.001) as fake:
+        monkeypatch.setenv('ONESIGNAL_API_URL', fake.url)
+        yield fake
+
+
+@pytest.fixture
+def mailer(server):
+    from onesignal_mailer import OneSignalMailer
+    from retry import RetryPolicy
+
+    with OneSignalMailer(api_url=server.url, retry_policy=RetryPolicy(max_attempts=1)) as mailer:
+        yield mailer
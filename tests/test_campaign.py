@@ -0,0 +1,18 @@
+from campaign import CampaignExecutor
+from rate_limiter import TokenBucket
+
+
+def test_batches_split_to_limiter_burst(mailer, server):
+    sizes = []
+    executor = CampaignExecutor(mailer, workers=2, rate_limiter=TokenBucket(100, burst=5),
+                                on_result=lambda batch_result, progress: sizes.append(len(batch_result.recipients)))
+    result = executor.run("Hello", "Subject", [f"user{i}@example.com" for i in range(23)])
+
+    assert result.success_count == 23
+    assert sorted(sizes) == [3, 5, 5, 5, 5]
+    assert server.stats['requests'] == 5
+
+
+def test_per_request_limiter_keeps_batch_size(mailer):
+    executor = CampaignExecutor(mailer, batch_size=50, rate_limiter=TokenBucket(2, per='request'))
+    assert executor._request_size() == 50
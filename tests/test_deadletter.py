@@ -0,0 +1,57 @@
+import threading
+
+import requests
+
+import deadletter
+from deadletter import DeadLetterQueue, ReplayExecutor
+from onesignal_mailer import BatchResult
+
+
+def fill(dead_letters, mailer, count):
+    prepared = mailer.prepare("Hello", "Subject")
+    recipients = [f"user{i}@example.com" for i in range(count)]
+    dead_letters.record('campaign', prepared, BatchResult(recipients, error=requests.ConnectionError("reset")))
+    dead_letters.flush()
+    return recipients
+
+
+def test_claims_held_until_last_batch_is_back(tmp_path, mailer, server):
+    with DeadLetterQueue(str(tmp_path / 'dead.db')) as dead_letters:
+        fill(dead_letters, mailer, 30)
+        last_batch_sent = threading.Event()
+        finish_last_batch = threading.Event()
+        post_body = mailer.post_body
+
+        def slow_last_batch(body, recipient_count, prepaid=False):
+            if b'user29@' in body:
+                last_batch_sent.set()
+                finish_last_batch.wait(10)
+            return post_body(body, recipient_count, prepaid=prepaid)
+
+        mailer.post_body = slow_last_batch
+        executor = ReplayExecutor(mailer, dead_letters=dead_letters, workers=1, batch_size=10)
+        replay = threading.Thread(target=executor.run, args=(None, None, dead_letters.replayable()))
+        replay.start()
+        assert last_batch_sent.wait(10)
+
+        # The first replay has read every row but its last batch is in flight
+        assert list(dead_letters.replayable()) == []
+        assert dead_letters.count_replayable() == 0
+
+        finish_last_batch.set()
+        replay.join(10)
+        assert server.stats['recipients'] == 30
+        assert [row['status'] for row in dead_letters.summary()] == ['replayed']
+
+
+def test_claims_renewed_while_replay_is_idle(tmp_path, mailer, monkeypatch):
+    monkeypatch.setattr(deadletter, 'REPLAY_LEASE', 0.3)
+    with DeadLetterQueue(str(tmp_path / 'dead.db')) as dead_letters:
+        fill(dead_letters, mailer, 5)
+        with dead_letters.replayable() as claim:
+            rows = iter(claim)
+            next(rows)
+            # Nothing is pulled for several lease periods, e.g. waiting on the rate limiter
+            threading.Event().wait(1.0)
+            assert dead_letters.count_replayable() == 0
+        assert dead_letters.count_replayable() == 5
@@ -0,0 +1,27 @@
+import threading
+import time
+
+from manager import FairShare
+
+
+def test_urgent_client_not_stuck_behind_full_batch_grant():
+    budget = FairShare(rate=10)
+    bulk, urgent = budget.client(weight=1), budget.client(weight=4)
+    stop = threading.Event()
+    bulk_thread = threading.Thread(target=bulk.acquire, args=(2000, stop))
+    bulk_thread.start()
+    try:
+        time.sleep(0.2)
+        started = time.monotonic()
+        assert urgent.acquire(5)
+        # A single 2000-token grant would have left it waiting ~200 s
+        assert time.monotonic() - started < 2.0
+    finally:
+        stop.set()
+        bulk_thread.join(5)
+    assert not bulk_thread.is_alive()
+
+
+def test_unlimited_budget_grants_at_once():
+    budget = FairShare()
+    assert budget.client().acquire(2000)
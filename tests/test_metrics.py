@@ -0,0 +1,33 @@
+import threading
+
+from metrics import SendMetrics, campaign_label
+
+
+def test_exited_threads_folded_into_totals():
+    metrics = SendMetrics()
+
+    def send(campaign):
+        with campaign_label(campaign):
+            metrics.observe_request(0.01, 202, 100, recipients=10)
+            metrics.observe_retry()
+
+    for round_ in range(50):
+        threads = [threading.Thread(target=send, args=(f"campaign-{round_ % 2}",)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    snapshot = metrics.snapshot()
+    assert len(metrics._shards) == 0
+    assert snapshot['campaign-0']['requests'] == 100
+    assert snapshot['campaign-1']['recipients'] == 1000
+    assert snapshot['campaign-1']['retries'] == 100
+    assert snapshot['campaign-0']['statuses'] == {'2xx': 100}
+
+
+def test_live_thread_counted_once():
+    metrics = SendMetrics()
+    metrics.observe_request(0.01, 500, 100)
+    assert metrics.snapshot()['default']['statuses'] == {'5xx': 1}
+    assert len(metrics._shards) == 1
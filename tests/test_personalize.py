@@ -0,0 +1,21 @@
+import pytest
+
+from campaign import CampaignExecutor
+
+
+def test_placeholder_typo_fails_before_sending(mailer, server):
+    mailer.set_email_template("<p>Hi {name}, {mesage}</p>")
+    recipients = [{'email': f"user{i}@example.com", 'name': f"User {i}"} for i in range(5)]
+
+    with pytest.raises(ValueError, match=r"\{mesage\}"):
+        CampaignExecutor(mailer).run("Hello", "Subject", recipients)
+    assert server.stats['requests'] == 0
+
+
+def test_merge_fields_filled_from_columns(mailer, server):
+    mailer.set_email_template("<p>Hi {name}, {message}</p>")
+    recipients = [{'email': f"user{i}@example.com", 'name': f"User {i % 2}"} for i in range(5)]
+
+    result = CampaignExecutor(mailer).run("Hello", "Subject", recipients)
+    assert result.success_count == 5
+    assert server.stats['requests'] == 2